@@ -6,7 +6,8 @@ speed and choose between light and dark map themes. When run the
 first time for a given date the application invokes
 ``build_day_cache`` to produce a 5‑second resolution position cache
 based on the GTFS timetable. Afterwards the positions are grouped
-into per‑trip lists and visualised using a `TripsLayer` from Pydeck.
+into per‑trip buffers and visualised with a deck.gl `TripsLayer` that
+is rendered once and animated entirely in the browser.
 
 To start the app locally use:
 
@@ -19,8 +20,12 @@ See the README.md for further details.
 
 from __future__ import annotations
 
+import base64
+import gzip
 import json
-import math
+import os
+import tempfile
+import zlib
 from pathlib import Path
 from string import Template
 from typing import Dict, List
@@ -30,9 +35,17 @@ import pandas as pd
 import streamlit as st
 import streamlit.components.v1 as components
 
+try:
+    import orjson
+except ImportError:  # orjson も任意依存。無ければ標準の json で直列化する
+    orjson = None
+
+from modules.fastpath import thin_and_dedup
 from modules.path_builder import build_day_cache
 
 # --- Constants ---
+COORD_SCALE = 1e-5  # 座標は小数第5位（約1m）に丸めて扱う
+
 POPULATION_COLUMNS = {
     "PTN_2025": "2025年 男女計総数",
     "PTN_2030": "2030年 男女計総数",
@@ -48,27 +61,180 @@ POPULATION_COLUMNS = {
 
 # --- Data Loading and Caching ---
 
-@st.cache_data(show_spinner=False, persist=True)
-def _load_cache(date_str: str, gtfs_dir: str) -> pd.DataFrame:
-    """Load a bus position cache from disk, building it if necessary."""
-    return build_day_cache(date_str, gtfs_dir=str(gtfs_dir))
+# 日次キャッシュの中身を決める入力（生成コードと GTFS）。どれかが更新されたら作り直す
+_DAY_CACHE_SOURCES = (
+    Path(__file__).parent / "modules" / "path_builder.py",
+    Path(__file__).parent / "modules" / "service_filter.py",
+)
+_DAY_CACHE_FEED_FILES = ("trips.txt", "stop_times.txt", "stops.txt", "calendar.txt", "calendar_dates.txt")
+
+
+def _day_cache_path(date_str: str, gtfs_dir: str) -> Path:
+    """Return the Parquet path of the day cache for ``date_str``.
+
+    The name carries the newest modification time of the cache builder
+    and of the feed tables it reads, so a change to either produces a new
+    file instead of serving stale positions.
+    """
+    sources = [*_DAY_CACHE_SOURCES, *(Path(gtfs_dir) / n for n in _DAY_CACHE_FEED_FILES)]
+    stamp = max(int(p.stat().st_mtime) for p in sources if p.exists())
+    return Path(gtfs_dir) / f"_cache_{date_str}_{stamp}.parquet"
+
+
+def _compact_day_cache(df: pd.DataFrame) -> pd.DataFrame:
+    """Return the day cache with dictionary-encoded ids and int32 timestamps.
+
+    ``trip_id``/``route_id`` become categoricals, which Parquet stores
+    with dictionary encoding, and ``timestamp`` (seconds of the day) is
+    narrowed to int32 when it fits.  Coordinates stay float64.
+    """
+    df = df.copy()
+    for col in ("trip_id", "route_id"):
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+    ts = df["timestamp"]
+    if len(ts) and np.iinfo(np.int32).min <= ts.min() and ts.max() <= np.iinfo(np.int32).max:
+        df["timestamp"] = ts.astype(np.int32)
+    return df
+
+
+def _read_day_cache(date_str: str, gtfs_dir: str) -> pd.DataFrame:
+    """Load a bus position cache from disk, building it if necessary.
+
+    The built frame is kept as a zstd Parquet file next to the GTFS feed
+    (ids dictionary-encoded, see :func:`_compact_day_cache`) so that a
+    fresh process reads it back instead of re-running the interpolation.  The file is written to a temporary name and renamed
+    into place, and an unreadable file is discarded and rebuilt.
+    """
+    cache_path = _day_cache_path(date_str, gtfs_dir)
+    if cache_path.exists():
+        try:
+            return pd.read_parquet(cache_path, engine="pyarrow")
+        except (OSError, ValueError):
+            # 壊れたキャッシュ（書き込み途中で落ちた等）は捨てて作り直す
+            cache_path.unlink(missing_ok=True)
+    df = _compact_day_cache(build_day_cache(date_str, gtfs_dir=str(gtfs_dir)))
+    tmp_path = None
+    try:
+        fd, tmp_path = tempfile.mkstemp(prefix=cache_path.stem, suffix=".tmp", dir=cache_path.parent)
+        os.close(fd)
+        df.to_parquet(tmp_path, compression="zstd", engine="pyarrow", index=False)
+        os.replace(tmp_path, cache_path)
+        tmp_path = None
+        # 古い版のキャッシュは不要
+        for old in cache_path.parent.glob(f"_cache_{date_str}*.parquet"):
+            if old != cache_path:
+                old.unlink(missing_ok=True)
+    except OSError:
+        # read-only feed directory: keep serving from memory
+        pass
+    finally:
+        if tmp_path is not None:
+            Path(tmp_path).unlink(missing_ok=True)
+    return df
+
+
+@st.cache_data(show_spinner=False)
+def _load_cache_arrays(date_str: str, gtfs_dir: str, cache_name: str) -> dict[str, np.ndarray]:
+    """Return the day cache as flat NumPy columns.
+
+    ``trip_id`` and ``route_id`` are factorized into integer codes plus
+    their unique values, so Streamlit pickles a handful of contiguous
+    buffers instead of a DataFrame of per-row Python strings.  The arrays
+    are only memoised in memory: the Parquet day cache is the on-disk copy.
+    ``cache_name`` is the name from :func:`_day_cache_path`; it only takes
+    part in the cache key, so the arrays follow the Parquet file when the
+    feed or the builder changes.
+    """
+    df = _read_day_cache(date_str, gtfs_dir)
+    route_codes, route_ids = pd.factorize(df["route_id"])
+    # 行を (路線コード, trip, 時刻) 順に一度だけ並べ替えて保持し、各路線の区間境界を持つ。
+    # 路線選択は連続区間の切り出しだけで済む（行番号による gather も全行走査もしない）
+    order = np.lexsort((df["timestamp"].to_numpy(), pd.factorize(df["trip_id"])[0], route_codes))
+    route_codes = route_codes[order]
+    # trip コードは並べ替え後の出現順に振り直す。どの路線の組み合わせを切り出しても
+    # trip コード・時刻の昇順になっているので、下流のソートを省ける
+    trip_codes, trip_ids = pd.factorize(df["trip_id"].to_numpy()[order])
+    return {
+        "trip_code": trip_codes.astype(np.int32),
+        "trip_ids": np.asarray(trip_ids, dtype=object),
+        "route_code": route_codes.astype(np.int32),
+        "route_ids": np.asarray(route_ids, dtype=object),
+        "route_bounds": np.searchsorted(route_codes, np.arange(len(route_ids) + 1)),
+        # 時刻は 1 日の秒数なので int32 で足りる。座標は 1e-5 度の格子より細かい精度が要るので float64 のまま
+        "timestamp": df["timestamp"].to_numpy(dtype=np.int32)[order],
+        "lat": df["lat"].to_numpy()[order],
+        "lon": df["lon"].to_numpy()[order],
+    }
+
+
+def _route_spans(route_bounds: np.ndarray, categories: np.ndarray, route_ids: list[str]) -> list[slice]:
+    """Return the row slices holding the routes in ``route_ids``, in code order.
+
+    The cached rows are grouped by route code and
+    ``route_bounds[c]:route_bounds[c + 1]`` is the slice for code ``c``.
+    Rows with a missing route (code -1) sort before every slice and are
+    never selected; unknown ids are ignored.
+    """
+    codes = pd.Index(categories).get_indexer(route_ids)
+    codes = np.unique(codes[codes >= 0])
+    return [slice(route_bounds[c], route_bounds[c + 1]) for c in codes]
+
+
+def _load_cache(date_str: str, gtfs_dir: str, route_ids: list[str] | None = None) -> pd.DataFrame:
+    """Rebuild the day cache frame from the cached arrays (ids become categoricals).
+
+    Rows come grouped by route.  With ``route_ids`` only the slices of
+    those routes are copied out.
+    """
+    a = _load_cache_arrays(date_str, str(gtfs_dir), _day_cache_path(date_str, gtfs_dir).name)
+    spans = None if route_ids is None else _route_spans(a["route_bounds"], a["route_ids"], route_ids)
+
+    def take(col: np.ndarray) -> np.ndarray:
+        if spans is None:
+            return col
+        return np.concatenate([col[sl] for sl in spans] or [col[:0]])
+
+    return pd.DataFrame({
+        "trip_id": pd.Categorical.from_codes(take(a["trip_code"]), a["trip_ids"]),
+        "timestamp": take(a["timestamp"]),
+        "lat": take(a["lat"]),
+        "lon": take(a["lon"]),
+        "route_id": pd.Categorical.from_codes(take(a["route_code"]), a["route_ids"]),
+    })
+
+
+@st.cache_data(show_spinner=False)
+def _day_cache_rows(date_str: str, gtfs_dir: str, cache_name: str) -> int:
+    """Row count of the day cache, so reruns can check it without unpickling the arrays."""
+    return len(_load_cache_arrays(date_str, gtfs_dir, cache_name)["timestamp"])
+
 
 @st.cache_data(show_spinner=False)
 def load_geojson_data(path: str) -> dict:
     """Loads GeoJSON data from a file."""
+    if orjson is not None:
+        # 埋め込みと同じく orjson があればバイト列のまま読む
+        return orjson.loads(Path(path).read_bytes())
     with open(path, "r", encoding="utf-8") as f:
         return json.load(f)
 
 @st.cache_data(show_spinner=False)
 def load_trips(gtfs_dir: str) -> pd.DataFrame:
     p = Path(gtfs_dir) / "trips.txt"
-    return pd.read_csv(p, dtype={"trip_id": str, "route_id": str})[["trip_id", "route_id"]]
+    # id 列は Arrow 文字列で持つ（isin / merge が Arrow の比較カーネルで走る）
+    ids = {"trip_id": "string[pyarrow]", "route_id": "string[pyarrow]"}
+    # Arrow のマルチスレッド CSV リーダで必要列だけを読む
+    return pd.read_csv(p, dtype=ids, usecols=list(ids), engine="pyarrow")[["trip_id", "route_id"]]
 
 @st.cache_data(show_spinner=False)
 def load_stop_times(gtfs_dir: str) -> pd.DataFrame:
     p = Path(gtfs_dir) / "stop_times.txt"
-    # 必要列のみ。stop_sequence は int にして並び替え
-    df = pd.read_csv(p, dtype={"trip_id": str, "stop_id": str})
+    # 必要列のみを Arrow の CSV リーダで読む。stop_sequence は int にして並び替え
+    header = pd.read_csv(p, nrows=0).columns
+    usecols = [c for c in ("trip_id", "stop_id", "stop_sequence") if c in header]
+    df = pd.read_csv(p, dtype={"trip_id": "string[pyarrow]", "stop_id": "string[pyarrow]"},
+                     usecols=usecols, engine="pyarrow")
     if "stop_sequence" in df.columns:
         df["stop_sequence"] = pd.to_numeric(df["stop_sequence"], errors="coerce").astype("Int64")
     else:
@@ -80,7 +246,8 @@ def load_stop_times(gtfs_dir: str) -> pd.DataFrame:
 def load_routes(gtfs_dir: str) -> pd.DataFrame:
     # Path型に合わせて結合（strでも動くがPathの方が安全）
     routes_path = (Path(gtfs_dir) / "routes.txt")
-    return pd.read_csv(routes_path, dtype={'route_id': str})
+    # Arrow のマルチスレッド CSV リーダで読む
+    return pd.read_csv(routes_path, dtype={'route_id': str}, engine="pyarrow", dtype_backend="pyarrow")
 
 @st.cache_data(show_spinner=False)
 def make_route_display_map(gtfs_dir: str) -> dict[str, str]:
@@ -92,159 +259,340 @@ def make_route_display_map(gtfs_dir: str) -> dict[str, str]:
     long = long.fillna("").astype(str).str.strip()
     short = short.fillna("").astype(str).str.strip()
 
-    def compose(row):
-        l, s, rid = row["long"], row["short"], row["route_id"]
-        if l and s: return f"{l} ({s})"
-        if l:       return l
-        if s:       return s
-        return str(rid)
-
-    tmp = pd.DataFrame({"route_id": df["route_id"].astype(str), "long": long, "short": short})
-    tmp["display_name"] = tmp.apply(compose, axis=1)
-    return tmp.set_index("route_id")["display_name"].to_dict()
+    # 「長い名前 (短い名前)」→ 長い名前 → 短い名前 → route_id の優先順を列演算で組み立てる
+    rid = df["route_id"].astype(str)
+    has_long, has_short = long != "", short != ""
+    name = rid.where(~has_short, short)
+    name = name.where(~has_long, long)
+    name = name.where(~(has_long & has_short), long + " (" + short + ")")
+    return dict(zip(rid, name))
 
 # --- Stops Loading ---
 @st.cache_data(show_spinner=False)
 def load_stops(gtfs_dir: str) -> pd.DataFrame:
     stops_path = Path(gtfs_dir) / "stops.txt"
-    df = pd.read_csv(stops_path, dtype={"stop_id": str})
+    df = pd.read_csv(stops_path, dtype={"stop_id": str}, engine="pyarrow", dtype_backend="pyarrow")
     df = df.rename(columns={"stop_lat": "lat", "stop_lon": "lon"})
     df = df[["stop_id", "stop_name", "lat", "lon"]].dropna(subset=["lat", "lon"])
-    # 近い点の重複を抑えるため軽く丸め（見た目・描画負荷対策）
-    df["lat"] = df["lat"].round(5)
-    df["lon"] = df["lon"].round(5)
+    # 近い点の重複を抑えるため軽く丸め（見た目・描画負荷対策）。2列まとめて ndarray 上で丸める
+    coords = df[["lat", "lon"]].to_numpy(dtype=np.float64)
+    np.round(coords, 5, out=coords)
+    df[["lat", "lon"]] = coords
     return df
 
 @st.cache_data(show_spinner=False)
-def to_stops_payload(df: pd.DataFrame) -> list[dict]:
-    # deck.gl に渡す JSON（lon,lat の順に注意）
-    return [
-        {"stop_id": r.stop_id, "name": str(r.stop_name), "coord": [float(r.lon), float(r.lat)]}
-        for r in df.itertuples(index=False)
-    ]
+def to_stops_payload(gtfs_dir: str) -> dict:
+    # キャッシュのキーは gtfs_dir の文字列だけ（停留所の DataFrame を毎回ハッシュしない）
+    df = load_stops(gtfs_dir)
+    # deck.gl の binary data 形式で渡す（座標は lon,lat の順に詰めた配列、名前は並行配列）
+    names = df["stop_name"].astype(str).tolist()
+    return {
+        "length": int(len(df)),
+        "stop_ids": df["stop_id"].astype(str).tolist(),
+        "names": names,
+        # TextLayer のフォントアトラス用文字集合（ブラウザで毎回数え直さない）
+        "charset": "".join(sorted(set("".join(names)))),
+        "positions": _pack_quantized(df[["lon", "lat"]].to_numpy(dtype=np.float64), COORD_SCALE, fallback=np.float32),
+    }
 
 @st.cache_data(show_spinner=False)
-def build_unique_edges(
-    gtfs_dir: str,
-    selected_route_ids: list[str],
-    stops_df: pd.DataFrame
-) -> list[dict]:
-    """選択路線に含まれる trip だけから、停留所ペア（無向）をユニーク化して返す。"""
-    # ✅ display_name はここで作る
-    route_names_map = make_route_display_map(gtfs_dir)
+def _edges_by_route(gtfs_dir: str) -> pd.DataFrame:
+    """フィード全体の停留所ペア（無向）を路線ごとに集計した表を返す。
 
+    列は ``route_id, edge_key, a, b, pos, trips_count``。``pos`` はその路線で
+    線分が最初に現れた位置（trip_id, stop_sequence 順）で、路線をまたいで
+    代表の向き（a, b）を選ぶのに使う。路線選択が変わってもこの表は作り直さない。
+    """
     trips = load_trips(gtfs_dir)
     stimes = load_stop_times(gtfs_dir)
-
-    # 選択路線の trip のみに限定
-    trips_sel = trips[trips["route_id"].isin(selected_route_ids)]
-    st_sel = stimes.merge(trips_sel, on="trip_id", how="inner")
+    st_all = stimes.merge(trips, on="trip_id", how="inner")
 
     # trip 内で stop_sequence 順に並べて隣接ペアを作る
-    st_sel = st_sel.sort_values(["trip_id", "stop_sequence"])
-    st_sel["next_stop_id"] = st_sel.groupby("trip_id")["stop_id"].shift(-1)
-    pairs = st_sel.dropna(subset=["next_stop_id"]).copy()
+    st_all = st_all.sort_values(["trip_id", "stop_sequence"])
+    st_all["next_stop_id"] = st_all.groupby("trip_id")["stop_id"].shift(-1)
+    pairs = st_all.dropna(subset=["next_stop_id"]).copy()
     pairs["a"] = pairs["stop_id"].astype(str)
     pairs["b"] = pairs["next_stop_id"].astype(str)
+    pairs["pos"] = np.arange(len(pairs))
+
+    # 無向化（A,B をソートして同一視）。停留所 ID を辞書順の整数コードにして
+    # (小さい方, 大きい方) を 1 つの int64 キーに詰める（行ごとの文字列比較・連結をしない）
+    codes, uniques = pd.factorize(pd.concat([pairs["a"], pairs["b"]]), sort=True)
+    a_codes, b_codes = codes[:len(pairs)], codes[len(pairs):]
+    lo = np.minimum(a_codes, b_codes).astype(np.int64)
+    hi = np.maximum(a_codes, b_codes).astype(np.int64)
+    pairs["edge_key"] = lo * (len(uniques) + 1) + hi
+
+    return pairs.groupby(["route_id", "edge_key"], sort=False).agg(
+        a=("a", "first"),
+        b=("b", "first"),
+        pos=("pos", "first"),
+        trips_count=("trip_id", "nunique"),
+    ).reset_index()
 
-    # 無向化（A,B をソートして同一視）
-    ab_min = pairs[["a","b"]].min(axis=1)
-    ab_max = pairs[["a","b"]].max(axis=1)
-    pairs["edge_key"] = ab_min + "|" + ab_max
 
-    # edge_key ごとに route_id の集合と出現回数を集計
-    agg = pairs.groupby("edge_key").agg(
+@st.cache_data(show_spinner=False)
+def build_unique_edges(
+    gtfs_dir: str,
+    selected_route_ids: list[str],
+    _stops_df: pd.DataFrame,
+    _route_names_map: dict[str, str],
+) -> list[dict]:
+    """選択路線に含まれる trip だけから、停留所ペア（無向）をユニーク化して返す。
+
+    ``_stops_df`` と ``_route_names_map`` は :func:`load_stops` と
+    :func:`make_route_display_map` の結果（main で作ったものを渡す）。どちらも
+    ``gtfs_dir`` から決まるので、先頭の ``_`` でキャッシュのハッシュ対象から外す。
+    """
+    # 路線ごとの集計表から選択路線の行だけを取り出して束ねる（stop_times は読み直さない）
+    by_route = _edges_by_route(gtfs_dir)
+    sel = by_route[by_route["route_id"].isin(selected_route_ids)].sort_values("pos")
+
+    # edge_key ごとに route_id の集合と出現回数を集計（trip は 1 路線にしか属さないので件数は和）
+    agg = sel.groupby("edge_key").agg(
         a=("a", "first"),  # 代表（見た目にはどちらでも良い）
         b=("b", "first"),
         routes=("route_id", lambda s: tuple(sorted(set(s)))),
-        trips_count=("trip_id", "nunique"),
+        trips_count=("trips_count", "sum"),
     ).reset_index(drop=True)
 
-    # 停留所座標を引き当て（事前に丸め済みの lat/lon を使う）
-    stop_map = stops_df.set_index("stop_id")[["lat", "lon", "stop_name"]].to_dict("index")
-
-    edges_payload = []
-    for r in agg.itertuples(index=False):
-        if r.a not in stop_map or r.b not in stop_map:
-            continue
-        a_info = stop_map[r.a]
-        b_info = stop_map[r.b]
-        edges_payload.append({
-            "path": [[float(a_info["lon"]), float(a_info["lat"])],
-                     [float(b_info["lon"]), float(b_info["lat"]) ]],
-            "routes": list(r.routes),                # この線分を走る route_id 群
-            "a_name": str(a_info["stop_name"]),
-            "b_name": str(b_info["stop_name"]),
-            "trips_count": int(r.trips_count),        # どのくらい使われているか（ツールチップ用）
-            "route_names": [route_names_map.get(str(rid), str(rid)) for rid in r.routes]
-        })
-    return edges_payload
-
-
-def thin_by_time(df: pd.DataFrame, step_sec: int) -> pd.DataFrame:
-    # 各 trip 内で相対時刻に変換して % step == 0 の行だけ残す
-    df = df.sort_values(["trip_id", "timestamp"])
-    df["t0"] = df.groupby("trip_id")["timestamp"].transform("min")
-    keep = ((df["timestamp"] - df["t0"]) % step_sec) == 0
-    return df.loc[keep, ["trip_id","lat","lon","timestamp","route_id"]]
-
-def drop_near_duplicates(df: pd.DataFrame, eps_m: float = 3.0) -> pd.DataFrame:
-    # ほぼ同一点が連続する場合を除去（水平距離eps_m未満）
-    R = 6371000.0
-    def hav(lat1, lon1, lat2, lon2):
-        dlat=math.radians(lat2-lat1); dlon=math.radians(lon2-lon1)
-        la1, lo1 = math.radians(lat1), math.radians(lon1)
-        x = math.sin(dlat/2)**2 + math.cos(la1)*math.cos(math.radians(lat2))*math.sin(dlon/2)**2
-        return 2*R*math.atan2(math.sqrt(x), math.sqrt(1-x))
-    
-    kept_indices = []
-    for trip_id, g in df.groupby("trip_id"):
-        g = g.sort_values("timestamp") # 時系列でソート
-        prev_row = None
-        # itertuples(index=True) で高速化
-        for row in g.itertuples(index=True):
-            if prev_row is None or hav(prev_row.lat, prev_row.lon, row.lat, row.lon) >= eps_m:
-                kept_indices.append(row.Index)
-                prev_row = row
-    return df.loc[kept_indices].reset_index(drop=True)
+    # 停留所座標を引き当て（事前に丸め済みの lat/lon を使う）。行ごとの dict 参照ではなく
+    # a 側・b 側の 2 回の merge で一括で付ける（座標の無い停留所を含む線分は inner で落ちる）
+    stops = _stops_df.drop_duplicates("stop_id", keep="last")
+    stops = pd.DataFrame({
+        "stop_id": stops["stop_id"].astype(str).to_numpy(),
+        "lat": stops["lat"].to_numpy(dtype=np.float64),
+        "lon": stops["lon"].to_numpy(dtype=np.float64),
+        "name": stops["stop_name"].astype(str).to_numpy(),
+    })
+    agg = agg.merge(stops.add_prefix("a_"), left_on="a", right_on="a_stop_id", how="inner")
+    agg = agg.merge(stops.add_prefix("b_"), left_on="b", right_on="b_stop_id", how="inner")
+
+    paths = np.stack([agg[["a_lon", "a_lat"]].to_numpy(), agg[["b_lon", "b_lat"]].to_numpy()], axis=1)
+    out = pd.DataFrame({
+        "path": paths.tolist(),
+        "routes": agg["routes"].map(list),                 # この線分を走る route_id 群
+        "a_name": agg["a_name"],
+        "b_name": agg["b_name"],
+        "trips_count": agg["trips_count"].astype(int),    # どのくらい使われているか（ツールチップ用）
+        "route_names": agg["routes"].map(lambda rs: [_route_names_map.get(str(rid), str(rid)) for rid in rs]),
+    })
+    return out.to_dict("records")
+
+
+def _sort_by_trip(df: pd.DataFrame) -> pd.DataFrame:
+    """Return ``df`` sorted by ``trip_id`` then ``timestamp`` (stable).
+
+    Frames cut from the day cache already are in that order: their
+    categorical trip codes and timestamps are checked in one vectorised
+    pass and the frame is returned as is, without a sort.
+    """
+    if isinstance(df["trip_id"].dtype, pd.CategoricalDtype) and len(df):
+        codes = df["trip_id"].cat.codes.to_numpy()
+        dc = np.diff(codes)
+        if codes[0] >= 0 and (dc >= 0).all() and (np.diff(df["timestamp"].to_numpy())[dc == 0] >= 0).all():
+            return df
+    return df.sort_values(["trip_id", "timestamp"], kind="stable")
+
+
+def _group_spans(trip_id: pd.Series) -> np.ndarray:
+    """Return the trip span boundaries of a trip-sorted column.
+
+    Trip ``b`` occupies rows ``spans[b]:spans[b + 1]``; the last entry is
+    the column length, so an empty column gives ``[0]``.  The comparison
+    runs on integer codes: the categorical codes when the column already
+    is categorical, otherwise codes from ``pd.factorize``.
+    """
+    if isinstance(trip_id.dtype, pd.CategoricalDtype):
+        codes = trip_id.cat.codes.to_numpy()
+    else:
+        codes = pd.factorize(trip_id)[0]
+    if not len(codes):
+        return np.zeros(1, dtype=np.int64)
+    return np.r_[0, np.flatnonzero(codes[1:] != codes[:-1]) + 1, len(codes)]
+
+
+def thin_and_drop_duplicates(df: pd.DataFrame, step_sec: int, eps_m: float = 3.0) -> pd.DataFrame:
+    """Thin each trip to a ``step_sec`` grid and drop points closer than ``eps_m``.
+
+    Within a trip, rows whose offset from the trip's first timestamp is a
+    multiple of ``step_sec`` are kept, except those lying less than
+    ``eps_m`` metres from the previously kept row.  The frame is put in
+    trip order (a no-op for day-cache frames) and
+    :func:`modules.fastpath.thin_and_dedup` marks the surviving
+    rows in a single compiled pass, so no intermediate thinned frame is
+    built.
+    """
+    df = _sort_by_trip(df)
+    lat = np.deg2rad(df["lat"].to_numpy(dtype=np.float64))
+    lon = np.deg2rad(df["lon"].to_numpy(dtype=np.float64))
+    ts = df["timestamp"].to_numpy()
+    spans = _group_spans(df["trip_id"])
+    keep = np.empty(len(df), dtype=bool)
+    thin_and_dedup(lat, lon, np.cos(lat), ts, spans, int(step_sec), float(eps_m), keep)
+    return df.loc[keep, ["trip_id", "lat", "lon", "timestamp", "route_id"]].reset_index(drop=True)
+
 
 # 追加: カラーパレット（ColorBrewer系）
 PALETTE = [
     [228,26,28],[55,126,184],[77,175,74],[152,78,163],[255,127,0],
     [255,255,51],[166,86,40],[247,129,191],[153,153,153],[2,129,138]
 ]
+# 路線番号 % 色数 で引く uint8 の色テーブル
+PALETTE_TABLE = np.array(PALETTE, dtype=np.uint8)
+
+
+def _route_colors(route_ids: list[str], all_route_ids: list[str]) -> dict[str, list[int]]:
+    """route_id → RGB。色番号は路線一覧（routes.txt の順）での位置なので、選択を変えても変わらない"""
+    pos = pd.Index(all_route_ids).get_indexer(route_ids)
+    # 一覧に無い路線は id の CRC32 を色番号にする（これも選択に依らず固定）
+    for i in np.flatnonzero(pos < 0):
+        pos[i] = zlib.crc32(str(route_ids[i]).encode("utf-8"))
+    rgb = PALETTE_TABLE[pos % len(PALETTE_TABLE)].tolist()
+    return dict(zip(route_ids, rgb))
+
+
+def _json_default(obj):
+    # 標準 json 用: orjson の OPT_SERIALIZE_NUMPY と同じく NumPy の配列・スカラーを通す
+    if isinstance(obj, (np.ndarray, np.generic)):
+        return obj.tolist()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def _to_json(obj) -> str:
+    # HTML に埋め込む payload の直列化。orjson があれば C 実装で一気に書き出す
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY).decode("utf-8")
+    # 無い場合も同じ出力に揃える（日本語はエスケープしない）
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False, default=_json_default)
+
+
+def _b64(arr: np.ndarray) -> str:
+    # 型付き配列をそのままバイト列にして HTML に埋め込める文字列にする
+    return base64.b64encode(np.ascontiguousarray(arr).tobytes()).decode("ascii")
+
+
+def _pack_quantized(values: np.ndarray, scale: float, fallback: type) -> dict:
+    """``values`` を列ごとの最小値からの ``scale`` 刻みに量子化して詰める。
+
+    全要素が uint16 に収まればそれを使い、収まらなければ ``fallback`` 型で
+    元の値をそのまま送る。ブラウザ側は ``origin + value * scale`` で復元する。
+    """
+    if values.ndim == 1:
+        values = values[:, None]
+    if len(values):
+        origin = values.min(axis=0)
+        q = np.rint((values - origin) / scale)
+        if q.max() <= np.iinfo(np.uint16).max:
+            return {"dtype": "uint16", "origin": origin.tolist(), "scale": scale,
+                    "data": _b64(q.astype(np.uint16))}
+    return {"dtype": np.dtype(fallback).name, "origin": [0] * values.shape[1], "scale": 1,
+            "data": _b64(values.astype(fallback))}
+
+
+def _pack_trip_deltas(values: np.ndarray, starts: np.ndarray, scale: float, fallback: type) -> dict:
+    """trip ごとの差分で ``values`` を詰める（``_pack_quantized`` の上位互換）。
+
+    uint16 の絶対値に収まればそれを使う。収まらなくても、``scale`` 刻みの
+    格子上で trip 内の隣接差分がすべて int16 に収まれば、各 trip 先頭の値を
+    ``anchors``（int32）に、差分を ``data``（int16）に入れて半分の大きさで送る。
+    ブラウザ側は trip ごとに差分を累積して ``origin + value * scale`` に戻す。
+    """
+    packed = _pack_quantized(values, scale, fallback)
+    if packed["dtype"] == "uint16" or not len(values):
+        return packed
+    values = values[:, None] if values.ndim == 1 else values
+    origin = values.min(axis=0)
+    q = np.rint((values - origin) / scale).astype(np.int64)
+    anchors = q[starts]
+    deltas = np.diff(q, axis=0, prepend=q[:1])
+    deltas[starts] = 0
+    if (np.abs(deltas).max() <= np.iinfo(np.int16).max
+            and anchors.max() <= np.iinfo(np.int32).max):
+        return {"dtype": "int16", "origin": origin.tolist(), "scale": scale,
+                "anchors": _b64(anchors.astype(np.int32)), "data": _b64(deltas.astype(np.int16))}
+    return packed
+
+
+def to_trips_payload(df: pd.DataFrame, route_colors: dict[str, list[int]]) -> dict:
+    """TripsLayer 用のバイナリ payload（base64 の型付き配列）を作る。
+
+    座標は lon,lat を交互に並べ、時刻は ``ts0`` からの相対秒にして、各 trip の
+    先頭位置を ``start_indices`` に持つ（deck.gl の binary data 形式）。
+    値域が収まる場合は uint16 に量子化して転送量を半分にする。
+    """
+    # trip・時刻順に揃え（日キャッシュ由来なら並べ替え済み）、trip の切れ目で連続領域をスライスする
+    df = _sort_by_trip(df)
+    starts = _group_spans(df["trip_id"])[:-1]
+    # route_id は trip 先頭行だけを取り出す（trip_id はブラウザで使わないので送らない）
+    trip_routes = df["route_id"].take(starts)
+
+    ts = df["timestamp"].to_numpy(dtype=np.int64)
+    ts0 = int(ts.min()) if len(ts) else 0
+    positions = df[["lon", "lat"]].to_numpy(dtype=np.float64)
+    # route_id を色テーブルの行番号に直して一括で引く（trip ごとの dict 参照をしない）。
+    # カテゴリ型なら変換表はカテゴリ数ぶんだけ作り、trip には整数コードで当てる
+    color_table = np.array(list(route_colors.values()), dtype=np.uint8).reshape(-1, 3)
+    if isinstance(trip_routes.dtype, pd.CategoricalDtype):
+        to_color = pd.Index(list(route_colors)).get_indexer(trip_routes.cat.categories)
+        codes = trip_routes.cat.codes.to_numpy()
+        codes = np.where(codes >= 0, to_color[codes], -1)
+    else:
+        codes = pd.Index(list(route_colors)).get_indexer(trip_routes)
+    colors = color_table[codes]
+    route_codes, route_list = pd.factorize(trip_routes)
+
+    return {
+        "length": int(len(starts)),
+        "ts0": ts0,
+        # trip ごとの route_id は辞書（route_list）への番号で送る（文字列を trip 数ぶん並べない）
+        "route_list": route_list.tolist(),
+        "route_codes": _pack_quantized(route_codes, 1, fallback=np.int32),
+        "start_indices": _b64(starts.astype(np.int32)),
+        "positions": _pack_trip_deltas(positions, starts, COORD_SCALE, fallback=np.float32),
+        # 1 日の幅が uint16 を超える場合も、trip 内の差分なら int16 に収まる
+        "timestamps": _pack_trip_deltas(ts - ts0, starts, 1, fallback=np.int32),
+        "colors": _b64(colors),
+    }
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def prepare_trips(
+    date_str: str, gtfs_dir: str, route_ids: tuple[str, ...], step_sec: int, cache_name: str
+) -> dict:
+    """Run the trip pipeline for one (date, route set, step) and return the payload.
+
+    The arguments are plain strings, a tuple and an int, so a rerun with
+    unchanged controls is a cache hit without hashing any DataFrame.  The
+    cache is kept in memory only (rebuilding a payload is cheap), and
+    ``cache_name`` (the day-cache file name) only takes part in the key so
+    that entries built from an older day cache are not reused.
+    Returns ``{"rows": 0}`` when the selected routes have no data that day.
+    """
+    filtered_df = _load_cache(date_str, gtfs_dir, list(route_ids))
+    if filtered_df.empty:
+        return {"rows": 0}
 
-@st.cache_data(show_spinner=False)
-def to_trips_payload(df: pd.DataFrame, route_colors: dict[str, list[int]]) -> list[dict]:
-    trips = []
-    for trip_id, g in df.groupby("trip_id", sort=False):
-        g = g.sort_values("timestamp")
-        rid = g["route_id"].iloc[0]
-        trips.append({
-            "trip_id": trip_id,
-            "route_id": rid,  # ← 追加
-            "path": g[["lon","lat"]].to_numpy().tolist(),
-            "timestamps": g["timestamp"].to_numpy(dtype=np.int32).tolist(),
-            "color": route_colors[rid],  # ← ルート別の色
-        })
-    return trips
+    processed_df = thin_and_drop_duplicates(filtered_df, step_sec=step_sec, eps_m=3.0)
 
-def render_trips_in_browser(
-    trips_data,
-    routes_ui,
-    view_state,
-    map_style,
-    min_ts, max_ts, step, trail_length=120, fps=24,
-    stops_data=None, show_labels=False, stop_size_px=6,
-    edges_data=None, show_edges=True, line_width_px=3,
-    trip_width_px=4, trail_opacity=220, edge_opacity=140,
-    mesh_data=None, show_mesh=False, selected_pop_column='PTN_2025'
-):
-    stops_data = stops_data or []
-    edges_data = edges_data or []
-    mesh_data = mesh_data or {"type": "FeatureCollection", "features": []}
+    # 色は路線ごとに固定（路線一覧での位置で決める）。他の路線を足し引きしても色は変わらない
+    present = set(processed_df["route_id"].unique())
+    uniq_routes = [rid for rid in route_ids if rid in present]
+    route_colors = _route_colors(uniq_routes, list(make_route_display_map(gtfs_dir)))
+    trips_data = to_trips_payload(processed_df, route_colors)
+
+    prepared = {"rows": len(filtered_df), "trips_data": trips_data, "route_colors": route_colors}
+    if trips_data["length"]:
+        # 2 列をまとめて 1 回の走査で合計し、件数で割る
+        lat_sum, lon_sum = processed_df[["lat", "lon"]].to_numpy().sum(axis=0)
+        prepared["center"] = (float(lat_sum / len(processed_df)), float(lon_sum / len(processed_df)))
+        prepared["min_ts"] = int(processed_df["timestamp"].min())
+        prepared["max_ts"] = int(processed_df["timestamp"].max())
+    return prepared
 
-    html_tmpl = Template(r"""
+
+# 描画用 HTML の雛形。再実行ごとに組み立て直さないようモジュール読み込み時に一度だけ作る
+_TRIPS_HTML = Template(r"""
     <div id="map-wrap" style="position:relative;height:80vh;width:100%;">
       <div id="deck-container" style="position:absolute;inset:0;"></div>
       <div id="clock-display" style="position: absolute; top: 20px; right: 20px; background: rgba(0,0,0,0.7); color: white; padding: 10px 15px; border-radius: 5px; font-family: 'Noto Sans JP', sans-serif; font-size: 24px; font-weight: bold; z-index: 10;"></div>
@@ -253,13 +601,78 @@ def render_trips_in_browser(
     <script src="https://unpkg.com/deck.gl@8.9.27/dist.min.js"></script>
     <script src="https://unpkg.com/maplibre-gl@2.4.0/dist/maplibre-gl.js"></script>
     <link href="https://unpkg.com/maplibre-gl@2.4.0/dist/maplibre-gl.css" rel="stylesheet"/>
-    <script>
-      const trips = $TRIPS;
-      const routes = $ROUTES;
-      const stops  = $STOPS;
-      const edges  = $EDGES;
-      const meshData = $MESH_DATA;
-      const initialViewState = $VIEW;
+    <script id="payload" type="application/octet-stream">$PAYLOAD</script>
+    <script type="module">
+      function decodeBase64(str) {
+        const bin = atob(str);
+        const out = new Uint8Array(bin.length);
+        for (let i = 0; i < bin.length; i++) out[i] = bin.charCodeAt(i);
+        return out.buffer;
+      }
+
+      // 量子化された配列を Float32Array（origin + value * scale）に戻す
+      const TYPED_ARRAYS = {int16: Int16Array, uint16: Uint16Array, int32: Int32Array, float32: Float32Array};
+      function decodePacked(p, startIndices) {
+        const raw = new TYPED_ARRAYS[p.dtype](decodeBase64(p.data));
+        const size = p.origin.length;
+        const out = new Float32Array(raw.length);
+        if (!p.anchors) {
+          for (let i = 0; i < raw.length; i++) out[i] = p.origin[i % size] + raw[i] * p.scale;
+          return out;
+        }
+        // trip ごとの差分形式: 先頭値 anchors から差分を累積して戻す
+        const anchors = new Int32Array(decodeBase64(p.anchors));
+        const n = raw.length / size;
+        for (let t = 0; t < startIndices.length; t++) {
+          const s = startIndices[t], e = t + 1 < startIndices.length ? startIndices[t + 1] : n;
+          for (let c = 0; c < size; c++) {
+            let q = anchors[t * size + c];
+            for (let i = s; i < e; i++) {
+              q += raw[i * size + c];
+              out[i * size + c] = p.origin[c] + q * p.scale;
+            }
+          }
+        }
+        return out;
+      }
+
+      // 大きなデータは gzip + base64 の JSON ブロックで受け取り、ブラウザの DecompressionStream で
+      // 展開してから JSON.parse する（JS リテラルとして構文解析させない）
+      async function readPayload() {
+        const gz = new Blob([decodeBase64(document.getElementById('payload').textContent)]);
+        const text = await new Response(gz.stream().pipeThrough(new DecompressionStream('gzip'))).text();
+        return JSON.parse(text);
+      }
+      const payload = await readPayload();
+
+      // trips は deck.gl の binary data 形式（型付き配列 + 各 trip の開始位置）で受け取る
+      const tripsPayload = payload.trips;
+      // 時刻は TS0 からの相対秒で持つ（float32 でも桁落ちしない）
+      const TS0 = tripsPayload.ts0;
+      const tripStarts = new Int32Array(decodeBase64(tripsPayload.start_indices));
+      const trips = {
+        length: tripsPayload.length,
+        routeIds: Array.from(decodePacked(tripsPayload.route_codes), c => tripsPayload.route_list[c]),
+        startIndices: tripStarts,
+        positions: decodePacked(tripsPayload.positions, tripStarts),
+        timestamps: decodePacked(tripsPayload.timestamps, tripStarts),
+        colors: new Uint8Array(decodeBase64(tripsPayload.colors)),
+      };
+
+      // 停留所も座標は型付き配列、名前・ID は TextLayer / ツールチップ用の並行配列
+      const stopsPayload = payload.stops;
+      const stops = {
+        length: stopsPayload.length,
+        stopIds: stopsPayload.stop_ids || [],
+        names: stopsPayload.names || [],
+        positions: stopsPayload.length ? decodePacked(stopsPayload.positions) : new Float32Array(0),
+      };
+      const CHARSET = Array.from(stopsPayload.charset || '');
+      const stopPosition = (_, {index}) => [stops.positions[index * 2], stops.positions[index * 2 + 1]];
+      const routes = payload.routes;
+      const edges  = payload.edges;
+      const meshData = payload.mesh;
+      const initialViewState = payload.view;
 
       const MIN_TS = $MIN_TS;
       const MAX_TS = $MAX_TS;
@@ -283,17 +696,19 @@ def render_trips_in_browser(
         initialViewState,
         map: maplibregl,
         mapStyle: "$MAP_STYLE",
-        getTooltip: ({object, layer}) => {
-          if (!object || !layer) return null;
-          if (layer.id === 'stops') return {text: object.name + " (" + object.stop_id + ")"};
-          if (layer.id === 'trips') return {text: "route: " + object.route_id};
+        getTooltip: ({object, layer, index}) => {
+          if (!layer) return null;
+          // binary data のレイヤは object を持たないので index で引く
+          if (layer.id === 'trips') return index >= 0 ? {text: "route: " + visibleTrips.routeIds[index]} : null;
+          if (layer.id === 'stops') return index >= 0 ? {text: stops.names[index] + " (" + stops.stopIds[index] + ")"} : null;
+          if (!object) return null;
           if (layer.id === 'route-edges') {
             const names = (object.route_names || object.routes || []).join(", ");
             return {text: object.a_name + " ↔ " + object.b_name + "\n路線: " + names};
           }
           if (layer.id === 'population-mesh') {
             const pop = object.properties[POP_COLUMN] || 0;
-            return {text: `推計人口: ${pop}人`};
+            return {text: `推計人口: $${pop}人`};
           }
           return null;
         }
@@ -309,12 +724,21 @@ def render_trips_in_browser(
         const h = String(date.getUTCHours()).padStart(2, '0');
         const m = String(date.getUTCMinutes()).padStart(2, '0');
         const s = String(date.getUTCSeconds()).padStart(2, '0');
-        clockElement.innerText = `${h}:${m}:${s}`;
+        clockElement.innerText = `$${h}:$${m}:$${s}`;
       }
 
-      function makeLayers(ct, visibleTrips) {
-        const routeColorMap = Object.fromEntries(routes.map(r => [String(r.route_id), r.color]));
-        const addAlpha = (rgb, a) => (rgb && rgb.length >= 3) ? [rgb[0], rgb[1], rgb[2], a] : [80,80,80,a];
+      const routeColorMap = Object.fromEntries(routes.map(r => [String(r.route_id), r.color]));
+      const addAlpha = (rgb, a) => (rgb && rgb.length >= 3) ? [rgb[0], rgb[1], rgb[2], a] : [80,80,80,a];
+
+      // 静的レイヤ（メッシュ・ライン・停留所）はフィルタ変更時だけ作り直す。
+      // アニメーション中は trips レイヤの currentTime だけを差し替える。
+      let visibleTrips = null;
+      let tripsData = null;
+      let tripsLayer = null;
+      let baseLayers = [];
+      let overlayLayers = [];
+
+      function makeStaticLayers() {
         const layers = [];
 
         if (SHOW_MESH && meshData && meshData.features) {
@@ -353,15 +777,12 @@ def render_trips_in_browser(
           }));
         }
 
-        layers.push(new deck.TripsLayer({
-          id: 'trips', data: visibleTrips, getPath: d => d.path, getTimestamps: d => d.timestamps,
-          getColor: d => addAlpha(d.color, TRAIL_ALPHA), widthMinPixels: TRIP_WIDTH,
-          trailLength: TRAIL, currentTime: ct, pickable: true
-        }));
-
+        const overlays = [];
         if (stops.length > 0) {
-          layers.push(new deck.ScatterplotLayer({
-            id: 'stops', data: stops, getPosition: d => d.coord, getRadius: d => 1,
+          overlays.push(new deck.ScatterplotLayer({
+            id: 'stops',
+            data: {length: stops.length, attributes: {getPosition: {value: stops.positions, size: 2}}},
+            getRadius: 1,
             radiusMinPixels: STOP_SIZE, radiusMaxPixels: STOP_SIZE, stroked: true, filled: true,
             getFillColor: [0, 0, 0, 200], getLineColor: [255, 255, 255, 220],
             lineWidthMinPixels: 1, pickable: true
@@ -369,9 +790,9 @@ def render_trips_in_browser(
         }
 
         if (SHOW_LABELS && stops.length > 0) {
-          const CHARSET = Array.from(new Set(stops.map(d => d.name).join('')));
-          layers.push(new deck.TextLayer({
-            id: 'stop-labels', data: stops, getPosition: d => d.coord, getText: d => d.name,
+          overlays.push(new deck.TextLayer({
+            id: 'stop-labels', data: {length: stops.length}, getPosition: stopPosition,
+            getText: (_, {index}) => stops.names[index],
             getSize: d => 14, sizeUnits: 'pixels', sizeScale: 1,
             fontFamily: 'Noto Sans JP, "Yu Gothic UI", Meiryo, "Hiragino Kaku Gothic ProN", sans-serif',
             characterSet: CHARSET, background: true, getBackgroundColor: [255,255,255,220],
@@ -379,12 +800,90 @@ def render_trips_in_browser(
             billboard: true, pickable: false, parameters: { depthTest: false }
           }));
         }
-        return layers;
+        return [layers, overlays];
+      }
+
+      // 有効な路線の trip だけを取り出した binary data を作る（全件有効ならそのまま使う）
+      // 路線ごとの trip 番号を一度だけ作っておき、フィルタ変更時は有効な路線のバケツだけを見る
+      const tripsByRoute = new Map();
+      for (let i = 0; i < trips.length; i++) {
+        const r = trips.routeIds[i];
+        let a = tripsByRoute.get(r);
+        if (!a) tripsByRoute.set(r, a = []);
+        a.push(i);
+      }
+
+      function selectTrips() {
+        let idx = [];
+        enabled.forEach(r => { const a = tripsByRoute.get(r); if (a) idx = idx.concat(a); });
+        if (idx.length === trips.length) return trips;
+        idx.sort((a, b) => a - b);
+
+        const vertexEnd = i => (i + 1 < trips.length ? trips.startIndices[i + 1] : trips.timestamps.length);
+        let nVertices = 0;
+        for (const i of idx) nVertices += vertexEnd(i) - trips.startIndices[i];
+        const out = {
+          length: idx.length,
+          routeIds: idx.map(i => trips.routeIds[i]),
+          startIndices: new Int32Array(idx.length),
+          positions: new Float32Array(nVertices * 2),
+          timestamps: new Float32Array(nVertices),
+          colors: new Uint8Array(idx.length * 3),
+        };
+        let v = 0;
+        idx.forEach((i, k) => {
+          const s = trips.startIndices[i], e = vertexEnd(i);
+          out.startIndices[k] = v;
+          out.positions.set(trips.positions.subarray(s * 2, e * 2), v * 2);
+          out.timestamps.set(trips.timestamps.subarray(s, e), v);
+          out.colors.set(trips.colors.subarray(i * 3, i * 3 + 3), k * 3);
+          v += e - s;
+        });
+        return out;
+      }
+
+      // data オブジェクトはフィルタ変更時だけ作り直す（毎フレーム同一参照なら GPU バッファは再生成されない）
+      function makeTripsData(t) {
+        // 色も頂点ごとの RGBA 配列にして binary attribute で渡す（trip ごとの accessor 呼び出しをなくす）
+        const nVertices = t.timestamps.length;
+        const vertexColors = new Uint8Array(nVertices * 4);
+        for (let i = 0; i < t.length; i++) {
+          const e = i + 1 < t.length ? t.startIndices[i + 1] : nVertices;
+          for (let v = t.startIndices[i]; v < e; v++) {
+            vertexColors[v * 4] = t.colors[i * 3];
+            vertexColors[v * 4 + 1] = t.colors[i * 3 + 1];
+            vertexColors[v * 4 + 2] = t.colors[i * 3 + 2];
+            vertexColors[v * 4 + 3] = TRAIL_ALPHA;
+          }
+        }
+        return {
+          length: t.length,
+          startIndices: t.startIndices,
+          attributes: {
+            getPath: {value: t.positions, size: 2},
+            getTimestamps: {value: t.timestamps, size: 1},
+            getColor: {value: vertexColors, size: 4},
+          },
+        };
+      }
+
+      function makeTripsLayer(ct) {
+        return new deck.TripsLayer({
+          id: 'trips', data: tripsData, _pathType: 'open',
+          widthMinPixels: TRIP_WIDTH, trailLength: TRAIL, currentTime: ct - TS0, pickable: true
+        });
+      }
+
+      function render() {
+        deckgl.setProps({ layers: [...baseLayers, tripsLayer, ...overlayLayers] });
       }
 
       function updateVisibleTrips() {
-        const visibleTrips = trips.filter(t => enabled.has(t.route_id));
-        deckgl.setProps({ layers: makeLayers(currentTime, visibleTrips) });
+        visibleTrips = selectTrips();
+        tripsData = makeTripsData(visibleTrips);
+        tripsLayer = makeTripsLayer(currentTime);
+        [baseLayers, overlayLayers] = makeStaticLayers();
+        render();
       }
 
       updateClock(currentTime);
@@ -398,19 +897,60 @@ def render_trips_in_browser(
         currentTime += STEP;
         if (currentTime > MAX_TS) currentTime = MIN_TS;
         updateClock(currentTime);
-        updateVisibleTrips();
+        // フレームごとは currentTime だけを差し替えた clone を渡す（props を組み直さない）
+        tripsLayer = tripsLayer.clone({currentTime: currentTime - TS0});
+        render();
+      }
+      // setInterval ではなく requestAnimationFrame で回す。描画と同期し、タブが非表示の間は止まる。
+      // FPS より速いディスプレイでは間隔が空くまでフレームを読み飛ばす
+      const FRAME_MS = 1000 / FPS;
+      let lastFrame = null;
+      function frame(now) {
+        requestAnimationFrame(frame);
+        if (lastFrame === null) lastFrame = now;
+        if (now - lastFrame < FRAME_MS) return;
+        // 端数は持ち越して平均の間隔を FRAME_MS に保つ（長く止まっていた後でも 1 ステップだけ進める）
+        lastFrame = now - (now - lastFrame) % FRAME_MS;
+        tick();
       }
-      setInterval(tick, Math.max(1, Math.floor(1000 / FPS)));
+      requestAnimationFrame(frame);
     </script>
-    """);
-
-    html = html_tmpl.safe_substitute(
-        TRIPS=json.dumps(trips_data, separators=(',', ':')),
-        ROUTES=json.dumps(routes_ui, separators=(',', ':')),
-        STOPS=json.dumps(stops_data, separators=(',', ':')),
-        EDGES=json.dumps(edges_data, separators=(',', ':')),
-        MESH_DATA=json.dumps(mesh_data, separators=(',', ':')),
-        VIEW=json.dumps(view_state, separators=(',', ':')),
+    """)
+
+
+def encode_map_payload(
+    trips_data, routes_ui, view_state, stops_data=None, edges_data=None, mesh_data=None
+) -> str:
+    """Serialize the map data into the string embedded in the HTML.
+
+    The result depends on the data only, not on the style controls, so it
+    is built once per full run and reused by every rerun of the map
+    fragment.
+    """
+    stops_data = stops_data or {"length": 0}
+    edges_data = edges_data or []
+    mesh_data = mesh_data or {"type": "FeatureCollection", "features": []}
+
+    payload = {
+        "trips": trips_data, "routes": routes_ui, "stops": stops_data,
+        "edges": edges_data, "mesh": mesh_data, "view": view_state,
+    }
+    # 複数路線では数 MB になるので gzip して埋め込む（速度優先で level 1。base64 なので </script> も現れない）
+    packed = base64.b64encode(gzip.compress(_to_json(payload).encode("utf-8"), compresslevel=1))
+    return packed.decode("ascii")
+
+
+def render_trips_in_browser(
+    payload: str,
+    map_style,
+    min_ts, max_ts, step, trail_length=120, fps=24,
+    show_labels=False, stop_size_px=6,
+    show_edges=True, line_width_px=3,
+    trip_width_px=4, trail_opacity=220, edge_opacity=140,
+    show_mesh=False, selected_pop_column='PTN_2025'
+):
+    html = _TRIPS_HTML.substitute(
+        PAYLOAD=payload,
         MIN_TS=min_ts, MAX_TS=max_ts, STEP=step, FPS=fps, TRAIL=trail_length,
         MAP_STYLE=map_style,
         SHOW_LABELS=json.dumps(bool(show_labels)),
@@ -426,6 +966,62 @@ def render_trips_in_browser(
     components.html(html, height=720)
 
 
+@st.fragment
+def render_map_fragment(
+    payload: str,
+    min_ts: int,
+    max_ts: int,
+    step: int,
+    show_edges: bool = True,
+    show_mesh: bool = False,
+    selected_pop_column: str = 'PTN_2025',
+) -> None:
+    """Render the map together with its style-only controls.
+
+    Runs as a Streamlit fragment: changing the theme, sizes or opacities
+    reruns only this function with the encoded payload of the last full
+    run, so the trip data is not reloaded, thinned or re-encoded.
+    """
+    # 見た目だけに効く設定はフラグメント内に置く（サイドバーはフラグメントから書けない）
+    with st.expander("地図の表示スタイル", expanded=False):
+        c1, c2, c3 = st.columns(3)
+        theme = c1.radio("地図テーマ", options=["Light", "Dark"], index=1, horizontal=True)
+        show_labels = c1.checkbox("バス停名ラベルを表示（高ズーム推奨）", value=False)
+        stop_size_px = c1.slider("バス停サイズ（px）", min_value=3, max_value=12, value=6)
+        line_width_px = c2.slider("ライン太さ（px）", 1, 8, 3)
+        edge_opacity = c2.slider("ラインの不透明度 (0-255)", 20, 255, 140)
+        trip_width_px = c3.slider(
+            "軌跡の太さ（px）", 1, 16, max(line_width_px + 1, 4)
+        )
+        trail_opacity = c3.slider("軌跡の不透明度 (0-255)", 50, 255, 220)
+
+    map_style = (
+        "https://basemaps.cartocdn.com/gl/voyager-gl-style/style.json"
+        if theme == "Light" else
+        "https://basemaps.cartocdn.com/gl/dark-matter-gl-style/style.json"
+    )
+
+    trail_length_tuned = int(min(240, max(60, step * 2)))
+
+    render_trips_in_browser(
+        payload=payload,
+        map_style=map_style,
+        min_ts=min_ts, max_ts=max_ts,
+        step=step,
+        trail_length=trail_length_tuned,
+        fps=24,
+        show_labels=show_labels,
+        stop_size_px=stop_size_px,
+        show_edges=show_edges,
+        line_width_px=line_width_px,
+        trip_width_px=trip_width_px,
+        trail_opacity=trail_opacity,
+        edge_opacity=edge_opacity,
+        show_mesh=show_mesh,
+        selected_pop_column=selected_pop_column
+    )
+
+
 def main() -> None:
     st.set_page_config(layout="wide")
     st.title("Ehime Bus Time‑Lapse Theater")
@@ -448,7 +1044,6 @@ def main() -> None:
     speed_option = st.sidebar.select_slider(
         "再生速度 (秒ステップ)", options=[1, 5, 10, 25, 60, 120, 300], value=60
     )
-    theme = st.sidebar.radio("地図テーマ", options=["Light", "Dark"], index=1)
 
     st.sidebar.subheader("メッシュ表示")
     show_mesh = st.sidebar.checkbox("人口メッシュを表示", value=False)
@@ -471,22 +1066,13 @@ def main() -> None:
 
     st.sidebar.subheader("バス停の表示")
     show_stops = st.sidebar.checkbox("バス停ポイントを表示", value=True)
-    show_labels = st.sidebar.checkbox("バス停名ラベルを表示（高ズーム推奨）", value=False)
-    stop_size_px = st.sidebar.slider("バス停サイズ（px）", min_value=3, max_value=12, value=6)
 
     st.sidebar.subheader("路線ライン")
     show_edges = st.sidebar.checkbox("停留所間ラインを表示", value=True)
-    line_width_px = st.sidebar.slider("ライン太さ（px）", 1, 8, 3)
-
-    st.sidebar.subheader("バスの軌跡（アニメーション）")
-    trip_width_px = st.sidebar.slider(
-        "軌跡の太さ（px）", 1, 16, max(line_width_px + 1, 4)
-    )
-    trail_opacity = st.sidebar.slider("軌跡の不透明度 (0-255)", 50, 255, 220)
-    edge_opacity = st.sidebar.slider("ラインの不透明度 (0-255)", 20, 255, 140)
 
     with st.spinner(f"{fixed_date_str} のキャッシュデータを生成・読込中..."):
-        df = _load_cache(fixed_date_str, gtfs_dir)
+        day_cache_name = _day_cache_path(fixed_date_str, gtfs_dir).name
+        day_rows = _day_cache_rows(fixed_date_str, str(gtfs_dir), day_cache_name)
 
     mesh_data = None
     if show_mesh:
@@ -502,13 +1088,12 @@ def main() -> None:
             st.warning("人口メッシュファイルが見つかりません。")
 
 
-    if df.empty:
+    if not day_rows:
         st.warning("選択した日に運行するサービスはありません。"); st.stop()
 
+    # 表示名の辞書はキャッシュ済み。再実行ごとに作り直さない
     route_options = make_route_display_map(gtfs_dir)
-    all_route_ids = list(route_options.keys())
-
-    route_keys = all_route_ids
+    route_keys = list(route_options)
     if "route_selector" not in st.session_state:
         st.session_state.route_selector = ['10025']
 
@@ -524,82 +1109,59 @@ def main() -> None:
     selected_route_ids = st.sidebar.multiselect(
         "表示する路線を選択",
         options=route_keys,
-        format_func=lambda x: route_options[x],
+        format_func=route_options.__getitem__,
         key="route_selector"
     )
 
-    stops_data = []
-    if show_stops or show_edges: # if we need edges, we need stops_df
-        stops_df = load_stops(gtfs_dir)
-        if show_stops:
-            stops_data = to_stops_payload(stops_df)
+    # 停留所・ラインのキャッシュは gtfs_dir の文字列をキーにする（DataFrame はハッシュしない）
+    stops_data = None
+    if show_stops:
+        stops_data = to_stops_payload(str(gtfs_dir))
 
     edges_data = []
     if show_edges:
-        if 'stops_df' not in locals():
-            stops_df = load_stops(gtfs_dir)
-        edges_data = build_unique_edges(gtfs_dir, selected_route_ids, stops_df)
+        edges_data = build_unique_edges(str(gtfs_dir), selected_route_ids, load_stops(str(gtfs_dir)), route_options)
 
     if not selected_route_ids:
         st.warning("路線を1つ以上選択してください。"); st.stop()
 
-    filtered_df = df[df['route_id'].isin(selected_route_ids)]
+    # 間引き〜payload 生成は (日付, 路線集合, 間引き秒) をキーにキャッシュ。路線の選択順はキーに含めない
+    prepared = prepare_trips(
+        fixed_date_str, str(gtfs_dir), tuple(sorted(selected_route_ids)), min(speed_option, 15),
+        day_cache_name,
+    )
 
-    if filtered_df.empty:
+    if not prepared["rows"]:
         st.warning("選択された路線は、この日に運行データがありません。"); st.stop()
 
-    st.success(f"{fixed_date_str} の {len(selected_route_ids)} 路線を読み込みました。(軌跡データ: {len(filtered_df):,}行)")
-
-    processed_df = thin_by_time(filtered_df, step_sec=min(speed_option, 15))
-    processed_df = drop_near_duplicates(processed_df, eps_m=3.0)
-    processed_df["lat"] = processed_df["lat"].round(5)
-    processed_df["lon"] = processed_df["lon"].round(5)
-    processed_df["timestamp"] = processed_df["timestamp"].astype(np.int32)
+    st.success(f"{fixed_date_str} の {len(selected_route_ids)} 路線を読み込みました。(軌跡データ: {prepared['rows']:,}行)")
 
-    uniq_routes = list(pd.unique(processed_df["route_id"]))
-    route_colors = {rid: PALETTE[i % len(PALETTE)] for i, rid in enumerate(uniq_routes)}
+    trips_data = prepared["trips_data"]
+    route_colors = prepared["route_colors"]
 
     routes_ui = [
-        {"route_id": rid, "name": route_options.get(rid, rid), "color": route_colors[rid]}
-        for rid in uniq_routes
+        {"route_id": rid, "name": route_options.get(rid, rid), "color": color}
+        for rid, color in route_colors.items()
     ]
 
-    trips_data = to_trips_payload(processed_df, route_colors)
-
-    if trips_data:
-        lat_center, lon_center = float(processed_df["lat"].mean()), float(processed_df["lon"].mean())
-        min_ts, max_ts = int(processed_df["timestamp"].min()), int(processed_df["timestamp"].max())
+    if trips_data["length"]:
+        lat_center, lon_center = prepared["center"]
+        min_ts, max_ts = prepared["min_ts"], prepared["max_ts"]
     else:
         st.warning("処理されたデータがありません。"); st.stop()
 
     view_state = dict(latitude=lat_center, longitude=lon_center, zoom=12, pitch=45, bearing=0)
-    map_style = (
-        "https://basemaps.cartocdn.com/gl/voyager-gl-style/style.json"
-        if theme == "Light" else
-        "https://basemaps.cartocdn.com/gl/dark-matter-gl-style/style.json"
-    )
-    
-    trail_length_tuned = int(min(240, max(60, speed_option * 2)))
 
-    render_trips_in_browser(
-        trips_data=trips_data,
-        routes_ui=routes_ui,
-        view_state=view_state,
-        map_style=map_style,
+    # 地図のデータはここで一度だけ直列化し、スタイル変更によるフラグメントの再実行では使い回す
+    payload = encode_map_payload(
+        trips_data, routes_ui, view_state,
+        stops_data=stops_data, edges_data=edges_data, mesh_data=mesh_data,
+    )
+    render_map_fragment(
+        payload=payload,
         min_ts=min_ts, max_ts=max_ts,
         step=speed_option,
-        trail_length=trail_length_tuned,
-        fps=24,
-        stops_data=stops_data,
-        show_labels=show_labels,
-        stop_size_px=stop_size_px,
-        edges_data=edges_data,
         show_edges=show_edges,
-        line_width_px=line_width_px,
-        trip_width_px=trip_width_px,
-        trail_opacity=trail_opacity,
-        edge_opacity=edge_opacity,
-        mesh_data=mesh_data,
         show_mesh=show_mesh,
         selected_pop_column=selected_pop_column
     )
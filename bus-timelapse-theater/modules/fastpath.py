@@ -0,0 +1,105 @@
+"""
+Compiled kernels for thinning and de-duplicating bus position traces.
+
+The day cache is sorted by ``trip_id`` and ``timestamp`` so that every
+trip occupies one contiguous span of rows.  :func:`thin_and_dedup` walks
+those spans with Numba, keeping only the samples that lie on a
+``step_sec`` grid relative to the trip start and are at least ``eps_m``
+metres from the last kept point, in a single pass.
+
+The kernels are serial (no ``parallel=True``).
+
+Numba is optional; without it the same functions run as plain Python.
+"""
+
+from __future__ import annotations
+
+import math
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional: fall back to plain Python loops
+    def njit(*args, **kwargs):
+        if args and callable(args[0]):
+            return args[0]
+        return lambda f: f
+
+
+EARTH_RADIUS_M = 6371000.0
+# Relative tolerance within which the equirectangular approximation is not
+# trusted and the haversine decides.
+EQUIRECT_BAND = 1e-3
+
+
+@njit(cache=True)
+def _far_enough(
+    plat: float, plon: float, pcos: float, lat: float, lon: float, coslat: float, eps_m: float
+) -> bool:
+    """Return whether two points (radians, with their cosines) are at least ``eps_m`` apart."""
+    # The great-circle distance is never shorter than the meridian distance,
+    # so a large enough latitude gap decides without any trigonometry.
+    dy = EARTH_RADIUS_M * (lat - plat)
+    if abs(dy) >= eps_m:
+        return True
+    # At metre scale the equirectangular distance agrees with the haversine
+    # to far better than EQUIRECT_BAND, so only squared distances inside
+    # that band around eps_m need the exact formula.
+    dx = EARTH_RADIUS_M * pcos * (lon - plon)
+    d2 = dx * dx + dy * dy
+    if d2 >= (eps_m * (1 + EQUIRECT_BAND)) ** 2:
+        return True
+    if d2 < (eps_m * (1 - EQUIRECT_BAND)) ** 2:
+        return False
+    x = math.sin((lat - plat) / 2) ** 2 + pcos * coslat * math.sin((lon - plon) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.atan2(math.sqrt(x), math.sqrt(1 - x)) >= eps_m
+
+
+@njit(cache=True)
+def thin_and_dedup(
+    lat: np.ndarray,
+    lon: np.ndarray,
+    coslat: np.ndarray,
+    ts: np.ndarray,
+    bounds: np.ndarray,
+    step_sec: int,
+    eps_m: float,
+    keep: np.ndarray,
+) -> None:
+    """Mark the rows that survive time thinning followed by de-duplication.
+
+    A row is kept when its offset from the first timestamp of its trip is
+    a multiple of ``step_sec`` and it lies at least ``eps_m`` metres from
+    the previously kept row of the trip.  This matches running the two
+    filters one after the other, without materialising the thinned frame.
+
+    Parameters
+    ----------
+    lat, lon : numpy.ndarray
+        Coordinates in radians, sorted by trip and time.
+    coslat : numpy.ndarray
+        ``cos(lat)`` precomputed for every point.
+    bounds : numpy.ndarray
+        Trip span boundaries; trip ``b`` is ``[bounds[b], bounds[b + 1])``.
+    eps_m : float
+        Minimum distance in metres from the previously kept row of the
+        trip.  The first row of each trip is always kept.
+    ts : numpy.ndarray
+        Timestamps in seconds, ascending within each trip.
+    step_sec : int
+        Thinning step in seconds.
+    keep : numpy.ndarray
+        Boolean output array of the same length as ``lat``; written in place.
+    """
+    for b in range(bounds.size - 1):
+        s, e = bounds[b], bounds[b + 1]
+        p = s
+        keep[s] = True
+        for i in range(s + 1, e):
+            keep[i] = False
+            if (ts[i] - ts[s]) % step_sec != 0:
+                continue
+            if _far_enough(lat[p], lon[p], coslat[p], lat[i], lon[i], coslat[i], eps_m):
+                keep[i] = True
+                p = i
@@ -3,13 +3,13 @@
 Generate per‑trip position traces from GTFS timetable information.
 
 This module contains a single entry point, :func:`build_day_cache`, which
-accepts a date string and produces a Feather file containing the
+accepts a date string and produces a Parquet file containing the
 latitude/longitude positions of every bus in the feed sampled every
 five seconds.  The implementation relies only on the basic GTFS
 tables—`trips.txt`, `stop_times.txt` and `stops.txt`—and therefore
 falls back to straight‑line interpolation between consecutive stops if
 no detailed shape geometry is available.  The output is stored in
-``data/cache/bus_trails_<YYYY‑MM‑DD>.feather`` by default.
+``data/cache/bus_trails_<YYYY‑MM‑DD>.parquet`` by default.
 
 Example usage:
 
@@ -25,64 +25,62 @@ cache and return a ``pandas.DataFrame``.
 from __future__ import annotations
 
 import argparse
+import hashlib
 import os
-from typing import Iterable, List, Tuple
+from typing import Iterable, Tuple
 
 import numpy as np
 import pandas as pd
 
-from .service_filter import get_valid_service_ids, hhmmss_to_sec
+from .service_filter import get_valid_service_ids, hhmmss_series_to_sec
 
 
-def _interpolate_segment(
-    trip_id: str,
-    t_a: int,
-    t_b: int,
-    lat_a: float,
-    lon_a: float,
-    lat_b: float,
-    lon_b: float,
+def _interpolate_segments(
+    t_a: np.ndarray,
+    t_b: np.ndarray,
+    lat_a: np.ndarray,
+    lon_a: np.ndarray,
+    lat_b: np.ndarray,
+    lon_b: np.ndarray,
     step: int = 5,
-) -> List[Tuple[str, int, float, float]]:
-    """Interpolate a single stop‑to‑stop segment.
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Interpolate many stop‑to‑stop segments in one vectorised pass.
 
-    Given start/end times and coordinates this helper returns a list of
-    tuples ``(trip_id, timestamp, lat, lon)`` sampled every ``step``
-    seconds between ``t_a`` and ``t_b`` inclusive.  If ``t_b <= t_a``
-    an empty list is returned.
+    Every segment ``k`` is sampled every ``step`` seconds from ``t_a[k]``
+    up to ``t_b[k]``; when the duration is not a multiple of ``step`` the
+    end time ``t_b[k]`` is appended as a final sample.  Positions are
+    interpolated linearly between the two stops.  All inputs are arrays
+    of equal length and every segment must satisfy ``t_b > t_a``.
 
     Parameters
     ----------
-    trip_id : str
-        Identifier of the trip.
-    t_a, t_b : int
+    t_a, t_b : numpy.ndarray
         Start and end timestamps (seconds since midnight).
-    lat_a, lon_a, lat_b, lon_b : float
+    lat_a, lon_a, lat_b, lon_b : numpy.ndarray
         Starting and ending coordinates.
     step : int, optional
         Sampling interval in seconds, by default 5.
 
     Returns
     -------
-    list of tuple
-        A list of rows describing the interpolated positions.
+    tuple of numpy.ndarray
+        ``(segment, timestamp, lat, lon)`` with one entry per sample;
+        ``segment`` is the index of the segment each sample belongs to.
+        Samples are ordered by segment, then by time.
     """
-    if t_b <= t_a:
-        return []
     duration = t_b - t_a
-    num_steps = (duration // step) + 1
-    timestamps = np.arange(t_a, t_b + 1, step, dtype=int)
-    # handle potential rounding so last timestamp equals t_b
-    if timestamps[-1] != t_b:
-        timestamps = np.append(timestamps, t_b)
-    # linear interpolation
-    ratios = (timestamps - t_a) / float(duration)
-    lats = lat_a + ratios * (lat_b - lat_a)
-    lons = lon_a + ratios * (lon_b - lon_a)
-    return [
-        (trip_id, int(ts), float(lat), float(lon))
-        for ts, lat, lon in zip(timestamps, lats, lons)
-    ]
+    counts = duration // step + 1 + (duration % step != 0)
+    segment = np.repeat(np.arange(len(t_a)), counts)
+    # position of every sample within its segment: 0, 1, 2, ...
+    first = np.cumsum(counts) - counts
+    k = np.arange(len(segment)) - first[segment]
+    timestamps = t_a[segment] + k * step
+    # the appended sample lands exactly on the segment end
+    np.minimum(timestamps, t_b[segment], out=timestamps)
+    ratios = (timestamps - t_a[segment]) / duration[segment].astype(float)
+    lats = lat_a[segment] + ratios * (lat_b - lat_a)[segment]
+    lons = lon_a[segment] + ratios * (lon_b - lon_a)[segment]
+    return segment, timestamps, lats, lons
 
 
 def build_day_cache(
@@ -90,13 +88,14 @@ def build_day_cache(
     gtfs_dir: str = "data/gtfs/LATEST",
     cache_dir: str = "data/cache",
     limit_trips: int | None = None,
+    route_ids: Iterable[str] | None = None,
 ) -> pd.DataFrame:
     """Build a per‑trip position cache for a single day.
 
     The function loads the GTFS tables from ``gtfs_dir``, filters the
     trips by those whose service is active on ``date``, interpolates
     between consecutive stops at five‑second intervals and writes the
-    result to a Feather file in ``cache_dir``.  The returned
+    result to a Parquet file in ``cache_dir``.  The returned
     ``pandas.DataFrame`` has columns ``['trip_id','timestamp','lat','lon']``.
 
     Parameters
@@ -108,11 +107,16 @@ def build_day_cache(
         ``data/gtfs/LATEST`` which should be a symlink to the most
         recent feed.
     cache_dir : str, optional
-        Directory where the Feather file will be written.  Defaults to
+        Directory where the Parquet file will be written.  Defaults to
         ``data/cache``.  The directory is created if necessary.
     limit_trips : int or None, optional
         If given, only the first ``limit_trips`` trips will be
         processed.  This parameter exists for testing and profiling.
+    route_ids : iterable of str or None, optional
+        If given, only trips of these routes are interpolated.  The
+        cache file name then carries a digest of the sorted ids, so
+        different selections do not overwrite each other or the
+        full-day file.
 
     Returns
     -------
@@ -122,14 +126,18 @@ def build_day_cache(
     """
     # Determine cache path
     os.makedirs(cache_dir, exist_ok=True)
-    out_path = os.path.join(cache_dir, f"bus_trails_{date}.feather")
+    suffix = ""
+    if route_ids is not None:
+        route_ids = sorted(set(route_ids))
+        suffix = "_" + hashlib.sha1(",".join(route_ids).encode("utf-8")).hexdigest()[:12]
+    out_path = os.path.join(cache_dir, f"bus_trails_{date}{suffix}.parquet")
 
     # Filter services active on this date
     service_ids = get_valid_service_ids(date, gtfs_dir=gtfs_dir)
     if not service_ids:
         # create and save empty frame
         empty_df = pd.DataFrame(columns=["trip_id", "timestamp", "lat", "lon"])
-        empty_df.to_feather(out_path)
+        empty_df.to_parquet(out_path, index=False)
         return empty_df
 
     # Load GTFS tables
@@ -137,84 +145,97 @@ def build_day_cache(
     stop_times_path = os.path.join(gtfs_dir, "stop_times.txt")
     stops_path = os.path.join(gtfs_dir, "stops.txt")
 
-    # Use dtype specification to ensure numeric ids remain strings
-    trips = pd.read_csv(trips_path, dtype=str)
-    stop_times = pd.read_csv(stop_times_path, dtype=str)
-    stops = pd.read_csv(stops_path, dtype={"stop_id": str, "stop_lat": float, "stop_lon": float})
+    # Read only the needed columns with the multithreaded Arrow CSV
+    # reader, typing them at parse time: ids stay strings (numeric-looking
+    # ids must not become ints) and stop_sequence is parsed as an integer.
+    trips = pd.read_csv(
+        trips_path,
+        usecols=["route_id", "service_id", "trip_id"],
+        dtype=str,
+        engine="pyarrow",
+    )
+    stop_times = pd.read_csv(
+        stop_times_path,
+        usecols=["trip_id", "departure_time", "stop_id", "stop_sequence"],
+        dtype={"trip_id": str, "departure_time": str, "stop_id": str, "stop_sequence": "int64"},
+        engine="pyarrow",
+    )
+    stops = pd.read_csv(
+        stops_path,
+        usecols=["stop_id", "stop_lat", "stop_lon"],
+        dtype={"stop_id": str, "stop_lat": float, "stop_lon": float},
+        engine="pyarrow",
+    )
 
     # Filter trips by service_id
     trips = trips[trips["service_id"].isin(service_ids)]
+    # Restrict to the requested routes before any interpolation work
+    if route_ids is not None:
+        trips = trips[trips["route_id"].isin(route_ids)]
     if limit_trips is not None:
         trips = trips.head(limit_trips)
 
     valid_trip_ids = set(trips["trip_id"].unique())
     # Filter stop_times
     stop_times = stop_times[stop_times["trip_id"].isin(valid_trip_ids)]
-    # Sort by trip_id then stop_sequence (cast stop_sequence to int)
-    stop_times["stop_sequence"] = stop_times["stop_sequence"].astype(int)
+    # Sort by trip_id then stop_sequence
     stop_times = stop_times.sort_values(["trip_id", "stop_sequence"])
 
-    # Map stops to coordinates
-    stop_coords = stops.set_index("stop_id")[["stop_lat", "stop_lon"]].to_dict("index")
-
-    records: List[Tuple[str, int, float, float]] = []
-
-    # Group by trip_id
-    for trip_id, group in stop_times.groupby("trip_id"):
-        group = group.reset_index(drop=True)
-        # iterate over consecutive stops
-        for idx in range(len(group) - 1):
-            row_a = group.iloc[idx]
-            row_b = group.iloc[idx + 1]
-            # parse times
-            t_a = hhmmss_to_sec(str(row_a["departure_time"]))
-            t_b = hhmmss_to_sec(str(row_b["departure_time"]))
-            # skip invalid or zero duration segments
-            if t_b <= t_a:
-                continue
-            # coordinates
-            coord_a = stop_coords.get(row_a["stop_id"])
-            coord_b = stop_coords.get(row_b["stop_id"])
-            if not coord_a or not coord_b:
-                continue
-            lat_a, lon_a = coord_a["stop_lat"], coord_a["stop_lon"]
-            lat_b, lon_b = coord_b["stop_lat"], coord_b["stop_lon"]
-            seg_records = _interpolate_segment(
-                trip_id=trip_id,
-                t_a=t_a,
-                t_b=t_b,
-                lat_a=lat_a,
-                lon_a=lon_a,
-                lat_b=lat_b,
-                lon_b=lon_b,
-                step=5,
-            )
-            records.extend(seg_records)
+    # Look up every stop's coordinates through an integer index into the
+    # stops table; -1 marks stops missing from stops.txt
+    stop_i = pd.Index(stops["stop_id"]).get_indexer(stop_times["stop_id"])
+    has_coord = stop_i >= 0
+    lat = np.append(stops["stop_lat"].to_numpy(dtype=float), np.nan)[stop_i]
+    lon = np.append(stops["stop_lon"].to_numpy(dtype=float), np.nan)[stop_i]
+
+    # Pull whole columns once; rows are already ordered by trip and stop
+    trip_ids = stop_times["trip_id"].to_numpy()
+    t = hhmmss_series_to_sec(stop_times["departure_time"])
+
+    # A segment joins two consecutive rows of the same trip.  Skip invalid
+    # or zero duration segments and those without coordinates.
+    valid = (
+        (trip_ids[1:] == trip_ids[:-1])
+        & (t[1:] > t[:-1])
+        & has_coord[1:]
+        & has_coord[:-1]
+    )
+    a_idx = np.flatnonzero(valid)
+    b_idx = a_idx + 1
+    seg, ts, lats, lons = _interpolate_segments(
+        t[a_idx], t[b_idx], lat[a_idx], lon[a_idx], lat[b_idx], lon[b_idx], step=5
+    )
 
     # Create DataFrame and join with trips to get route_id
-    df = pd.DataFrame(records, columns=["trip_id", "timestamp", "lat", "lon"])
+    if len(ts):
+        df = pd.DataFrame({"trip_id": trip_ids[a_idx][seg], "timestamp": ts, "lat": lats, "lon": lons})
+    else:
+        df = pd.DataFrame(columns=["trip_id", "timestamp", "lat", "lon"])
     if not df.empty:
         # Ensure trip_id types match for merging
         trips["trip_id"] = trips["trip_id"].astype(df["trip_id"].dtype)
         df = pd.merge(df, trips[["trip_id", "route_id"]], on="trip_id", how="left")
-    # Save to feather (use lz4 compression if available).  If the optional
-    # dependency ``pyarrow`` is unavailable or another error occurs,
-    # degrade gracefully by writing a CSV file instead.  The CSV name
-    # matches the feather name but uses a .csv extension.  Returning
-    # the DataFrame allows callers to continue even if writing fails.
+    # Save to Parquet with zstd compression.  The ids repeat for every
+    # sample, so they are written as categoricals and stored once per
+    # row group as dictionary pages.  If the optional dependency
+    # ``pyarrow`` is unavailable or another error occurs, degrade
+    # gracefully by writing a CSV file instead.  The CSV name matches the
+    # Parquet name but uses a .csv extension.  Returning the DataFrame
+    # allows callers to continue even if writing fails.
     try:
+        out = df.astype({c: "category" for c in ("trip_id", "route_id") if c in df})
         try:
-            df.to_feather(out_path, compression="lz4")
+            out.to_parquet(out_path, compression="zstd", index=False, row_group_size=200_000)
         except Exception:
             # fallback to default compression
-            df.to_feather(out_path)
+            out.to_parquet(out_path, index=False)
     except ImportError:
         # missing pyarrow; write CSV as fallback
-        csv_path = out_path.replace(".feather", ".csv")
+        csv_path = out_path.replace(".parquet", ".csv")
         df.to_csv(csv_path, index=False)
     except Exception:
         # final fallback: write CSV
-        csv_path = out_path.replace(".feather", ".csv")
+        csv_path = out_path.replace(".parquet", ".csv")
         df.to_csv(csv_path, index=False)
     return df
 
@@ -226,13 +247,17 @@ def main(argv: Iterable[str] | None = None) -> int:
     directly as a script.  It accepts a `--date` argument and optional
     `--gtfs-dir` and `--cache-dir` arguments.  Use the `--limit-trips`
     option to restrict the number of trips processed (useful for
-    debugging).
+    debugging) and `--route` (repeatable) to build only some routes.
     """
     parser = argparse.ArgumentParser(description="Build bus position cache for a given date.")
     parser.add_argument("--date", required=True, help="Date in YYYY-MM-DD format")
     parser.add_argument("--gtfs-dir", default="data/gtfs/LATEST", help="Path to GTFS feed directory")
     parser.add_argument("--cache-dir", default="data/cache", help="Path to cache directory")
     parser.add_argument("--limit-trips", type=int, default=None, help="Limit number of trips (debugging)")
+    parser.add_argument(
+        "--route", action="append", dest="routes", default=None,
+        help="Only build trips of this route_id (repeatable)",
+    )
     args = parser.parse_args(argv)
 
     build_day_cache(
@@ -240,6 +265,7 @@ def main(argv: Iterable[str] | None = None) -> int:
         gtfs_dir=args.gtfs_dir,
         cache_dir=args.cache_dir,
         limit_trips=args.limit_trips,
+        route_ids=args.routes,
     )
     return 0
 
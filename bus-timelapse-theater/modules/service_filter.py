@@ -1,7 +1,7 @@
 """
 Utilities for working with GTFS service calendars.
 
-This module exposes two helpers:
+This module exposes three helpers:
 
 * `get_valid_service_ids(date: str, gtfs_dir: str = 'data/gtfs/LATEST') -> set[str]` –
   return a set of `service_id` values that operate on the given date by
@@ -16,6 +16,9 @@ This module exposes two helpers:
   an integer number of seconds.  Hours may exceed 24 (e.g. `25:15:30`)
   which will be converted to 90930 seconds.  Invalid inputs return 0.
 
+* `hhmmss_series_to_sec(s: pd.Series) -> numpy.ndarray` – the same
+  conversion applied to a whole column at once.
+
 These utilities deliberately accept a GTFS directory parameter to
 facilitate testing and reuse.  If you keep your GTFS feeds in
 `data/gtfs/<YYYY‑MM‑DD>` you can point `gtfs_dir` at a specific
@@ -28,8 +31,15 @@ import os
 from datetime import datetime
 from typing import Set
 
+import numpy as np
 import pandas as pd
 
+# calendar.txt weekday flag columns, indexed by ``date.weekday()``
+WEEKDAY_COLUMNS = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+
+# ``HH:MM:SS`` with the surrounding whitespace and signs int() accepts
+_HHMMSS_RE = r"^\s*([+-]?\d+)\s*:\s*([+-]?\d+)\s*:\s*([+-]?\d+)\s*$"
+
 
 def hhmmss_to_sec(h: str) -> int:
     """Convert a time string ``HH:MM:SS`` to seconds.
@@ -59,6 +69,45 @@ def hhmmss_to_sec(h: str) -> int:
         return 0
 
 
+def hhmmss_series_to_sec(s: pd.Series) -> np.ndarray:
+    """Convert a column of ``HH:MM:SS`` strings to seconds in one pass.
+
+    This is the vectorised form of :func:`hhmmss_to_sec`: hours may exceed
+    24, surrounding whitespace is ignored and missing or malformed values
+    become 0.
+
+    Parameters
+    ----------
+    s : pandas.Series
+        Time strings, e.g. the ``departure_time`` column of
+        ``stop_times.txt``.
+
+    Returns
+    -------
+    numpy.ndarray
+        ``int64`` seconds since 00:00:00, one per element of ``s``.
+    """
+    # Fast path: the usual zero-padded ``HH:MM:SS`` is read straight off
+    # the UTF-32 code points; a ninth character marks a longer string.
+    chars = s.to_numpy(dtype=object).astype("U9").view(np.uint32).reshape(len(s), 9)
+    digits = chars[:, [0, 1, 3, 4, 6, 7]].astype(np.int64) - ord("0")
+    fixed = (
+        ((digits >= 0) & (digits <= 9)).all(axis=1)
+        & (chars[:, 2] == ord(":"))
+        & (chars[:, 5] == ord(":"))
+        & (chars[:, 8] == 0)
+    )
+    sec = np.zeros(len(s), dtype=np.int64)
+    sec[fixed] = digits[fixed] @ np.array([36000, 3600, 600, 60, 10, 1], dtype=np.int64)
+    # Anything else (unpadded hours, blanks, NaN, garbage) takes the regex
+    rest = np.flatnonzero(~fixed)
+    if rest.size:
+        parts = s.iloc[rest].astype("string").str.extract(_HHMMSS_RE)
+        ok = parts.notna().all(axis=1).to_numpy()
+        sec[rest[ok]] = parts[ok].to_numpy(dtype=np.int64) @ np.array([3600, 60, 1], dtype=np.int64)
+    return sec
+
+
 def get_valid_service_ids(date: str, gtfs_dir: str = "data/gtfs/LATEST") -> Set[str]:
     """Return the set of ``service_id`` values active on a given date.
 
@@ -100,49 +149,22 @@ def get_valid_service_ids(date: str, gtfs_dir: str = "data/gtfs/LATEST") -> Set[
     cal = pd.read_csv(cal_path, dtype=str)
     cal_dates = pd.read_csv(cal_dates_path, dtype=str)
 
-    valid_services: Set[str] = set()
-
-    # iterate calendar rows
-    for row in cal.itertuples(index=False):
-        # convert start_date and end_date (YYYYMMDD) to date objects
-        try:
-            start = datetime.strptime(row.start_date, "%Y%m%d").date()
-            end = datetime.strptime(row.end_date, "%Y%m%d").date()
-        except Exception:
-            continue
-        if not (start <= date_obj <= end):
-            continue
-        # determine day-of-week flag (Monday=0)
-        weekday_flags = {
-            0: row.monday,
-            1: row.tuesday,
-            2: row.wednesday,
-            3: row.thursday,
-            4: row.friday,
-            5: row.saturday,
-            6: row.sunday,
-        }
-        try:
-            if int(weekday_flags[date_obj.weekday()]) == 1:
-                valid_services.add(row.service_id)
-        except Exception:
-            # if flags are missing or non‑numeric skip
-            continue
-
-    # apply calendar dates overrides
-    for row in cal_dates.itertuples(index=False):
-        rec_date = str(row.date)
-        if rec_date != yyyymmdd:
-            continue
-        # apply exception
-        try:
-            exception_type = int(row.exception_type)
-        except Exception:
-            continue
-        sid = row.service_id
-        if exception_type == 1:
-            valid_services.add(sid)
-        elif exception_type == 2 and sid in valid_services:
-            valid_services.remove(sid)
-
-    return valid_services
\ No newline at end of file
+    # calendar: date range and weekday flag as whole-column masks.
+    # Unparseable dates or flags never match, like the rows skipped before.
+    start = pd.to_datetime(cal["start_date"], format="%Y%m%d", errors="coerce").dt.date
+    end = pd.to_datetime(cal["end_date"], format="%Y%m%d", errors="coerce").dt.date
+    in_range = (start <= date_obj) & (end >= date_obj)
+    weekday = WEEKDAY_COLUMNS[date_obj.weekday()]
+    active = in_range & (pd.to_numeric(cal[weekday], errors="coerce") == 1)
+    valid_services: Set[str] = set(cal.loc[active, "service_id"])
+
+    # apply calendar dates overrides.  Rows were applied in file order, so
+    # for a service listed more than once the last add/remove wins.
+    todays = cal_dates[cal_dates["date"] == yyyymmdd]
+    exception_type = pd.to_numeric(todays["exception_type"], errors="coerce")
+    todays = todays.assign(exception_type=exception_type)[exception_type.isin([1, 2])]
+    todays = todays.drop_duplicates("service_id", keep="last")
+    valid_services |= set(todays.loc[todays["exception_type"] == 1, "service_id"])
+    valid_services -= set(todays.loc[todays["exception_type"] == 2, "service_id"])
+
+    return valid_services
@@ -30,27 +30,35 @@ from urllib.parse import urlparse
 import requests
 
 
-def download_file(url: str) -> bytes:
-    """Fetch the content at ``url`` and return it as bytes.
-
-    Raises a ``requests.HTTPError`` if the request fails.
-    """
-    response = requests.get(url, timeout=60)
-    response.raise_for_status()
-    return response.content
+# Read and hash the response body in chunks of this many bytes
+CHUNK_SIZE = 1 << 16
 
 
-def write_file(path: str, data: bytes) -> None:
-    """Write binary data to a file, creating parent directories if needed."""
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, "wb") as fh:
-        fh.write(data)
+def fetch_with_hash(url: str, path: str) -> str:
+    """Stream the content at ``url`` into ``path`` and return its SHA‑256.
 
+    The body is written and hashed chunk by chunk, so memory use does not
+    grow with the size of the feed.  It is first written to ``path +
+    '.part'`` and renamed into place once complete, so an interrupted
+    download never leaves a truncated ZIP under the final name.  Parent
+    directories are created if needed.
 
-def compute_sha256(data: bytes) -> str:
-    """Compute the SHA‑256 digest of ``data`` and return it as a hex string."""
+    Raises a ``requests.HTTPError`` if the request fails.
+    """
     digest = hashlib.sha256()
-    digest.update(data)
+    with requests.get(url, stream=True, timeout=60) as response:
+        response.raise_for_status()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".part"
+        try:
+            with open(tmp_path, "wb") as fh:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    digest.update(chunk)
+                    fh.write(chunk)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
     return digest.hexdigest()
 
 
@@ -70,13 +78,11 @@ def main(argv: list[str] | None = None) -> int:
     sha_path = out_path + ".sha256"
 
     try:
-        data = download_file(url)
+        checksum = fetch_with_hash(url, out_path)
     except requests.HTTPError as exc:
         print(f"Failed to download {url}: {exc}", file=sys.stderr)
         return 1
 
-    write_file(out_path, data)
-    checksum = compute_sha256(data)
     with open(sha_path, "w", encoding="utf-8") as fh:
         fh.write(checksum)
     print(f"Downloaded {url} to {out_path}")
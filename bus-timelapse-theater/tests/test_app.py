@@ -0,0 +1,176 @@
+"""
+Unit tests for the data helpers in the Streamlit app.
+
+These tests exercise the pure DataFrame/NumPy helpers that feed the
+browser payloads; nothing here starts a Streamlit session.  The inputs
+are tiny hand-made frames so the expected values can be read off
+directly.
+"""
+
+import base64
+
+import numpy as np
+import pandas as pd
+
+import app
+
+
+def _decode(packed, starts=None):
+    # Mirror decodePacked() in the HTML template: origin + raw * scale
+    raw = np.frombuffer(base64.b64decode(packed["data"]), dtype=packed["dtype"])
+    ncols = len(packed["origin"])
+    raw = raw.reshape(-1, ncols).astype(np.int64 if "anchors" in packed else raw.dtype)
+    if "anchors" in packed:
+        # Per-trip deltas: accumulate from each trip's anchor value
+        anchors = np.frombuffer(base64.b64decode(packed["anchors"]), dtype=np.int32)
+        raw = raw.copy()
+        raw[starts] += anchors.reshape(-1, ncols)
+        for s, e in zip(starts, np.r_[starts[1:], len(raw)]):
+            raw[s:e] = np.cumsum(raw[s:e], axis=0)
+    return np.asarray(packed["origin"]) + raw * packed["scale"]
+
+
+def test_to_json_matches_orjson_without_it(monkeypatch):
+    obj = {"name": "市役所前", "codes": np.array([1, 2], dtype=np.int32), "x": np.float64(1.5), "ok": [True, None]}
+    expected = '{"name":"市役所前","codes":[1,2],"x":1.5,"ok":[true,null]}'
+    assert app._to_json(obj) == expected
+    monkeypatch.setattr(app, "orjson", None)
+    assert app._to_json(obj) == expected
+
+
+def test_pack_quantized_uint16_round_trip():
+    values = np.array([[132.70001, 33.80002], [132.71, 33.81], [132.7, 33.8]])
+    packed = app._pack_quantized(values, app.COORD_SCALE, fallback=np.float32)
+    assert packed["dtype"] == "uint16"
+    assert packed["origin"] == [132.7, 33.8]
+    np.testing.assert_allclose(_decode(packed), values, atol=app.COORD_SCALE / 2)
+
+
+def test_pack_quantized_falls_back_when_range_too_wide():
+    values = np.array([0, 70000, 5], dtype=np.int64)
+    packed = app._pack_quantized(values, 1, fallback=np.int32)
+    assert packed["dtype"] == "int32"
+    assert packed["origin"] == [0]
+    assert _decode(packed).ravel().tolist() == [0, 70000, 5]
+
+
+def test_pack_quantized_empty_input():
+    packed = app._pack_quantized(np.empty((0, 2)), app.COORD_SCALE, fallback=np.float32)
+    assert packed == {"dtype": "float32", "origin": [0, 0], "scale": 1, "data": ""}
+
+
+def test_pack_trip_deltas_round_trip_when_extent_exceeds_uint16():
+    # 1 degree of longitude is 100000 steps of 1e-5: too wide for uint16 offsets
+    values = np.array([[132.0, 33.8], [132.00003, 33.80001], [133.0, 33.9], [132.99998, 33.9]])
+    starts = np.array([0, 2])
+    packed = app._pack_trip_deltas(values, starts, app.COORD_SCALE, fallback=np.float32)
+    assert packed["dtype"] == "int16"
+    np.testing.assert_allclose(_decode(packed, starts), values, atol=app.COORD_SCALE / 2)
+
+
+def test_pack_trip_deltas_prefers_absolute_uint16():
+    values = np.array([[132.7, 33.8], [132.70001, 33.8]])
+    packed = app._pack_trip_deltas(values, np.array([0]), app.COORD_SCALE, fallback=np.float32)
+    assert packed["dtype"] == "uint16"
+    assert "anchors" not in packed
+
+
+def test_to_trips_payload_start_indices_and_colours():
+    # Rows deliberately out of order: the payload sorts by trip and time
+    df = pd.DataFrame({
+        "trip_id": ["t2", "t1", "t1", "t2", "t1"],
+        "timestamp": np.array([105, 110, 100, 100, 105], dtype=np.int32),
+        "lat": [33.82, 33.81, 33.80, 33.80, 33.805],
+        "lon": [132.72, 132.71, 132.70, 132.70, 132.705],
+        "route_id": ["rB", "rA", "rA", "rB", "rA"],
+    })
+    route_colors = {"rA": [1, 2, 3], "rB": [4, 5, 6]}
+    payload = app.to_trips_payload(df, route_colors)
+
+    assert payload["length"] == 2
+    assert "trip_ids" not in payload
+    route_codes = _decode(payload["route_codes"]).ravel().astype(int)
+    assert [payload["route_list"][c] for c in route_codes] == ["rA", "rB"]
+    assert payload["ts0"] == 100
+    starts = np.frombuffer(base64.b64decode(payload["start_indices"]), dtype=np.int32)
+    assert starts.tolist() == [0, 3]
+    colors = np.frombuffer(base64.b64decode(payload["colors"]), dtype=np.uint8)
+    assert colors.tolist() == [1, 2, 3, 4, 5, 6]
+    assert _decode(payload["timestamps"]).ravel().tolist() == [0, 5, 10, 0, 5]
+    np.testing.assert_allclose(
+        _decode(payload["positions"])[:, 1], [33.80, 33.805, 33.81, 33.80, 33.82], atol=1e-5
+    )
+
+
+def test_route_colors_do_not_depend_on_the_selection():
+    all_routes = [f"r{i}" for i in range(12)]
+    alone = app._route_colors(["r5"], all_routes)
+    # Adding a route that sorts earlier (and one missing from routes.txt) keeps r5's colour
+    both = app._route_colors(["r0", "r5", "zzz"], all_routes)
+    assert both["r5"] == alone["r5"] == app.PALETTE[5]
+    assert both["r0"] == app.PALETTE[0]
+    assert app._route_colors(["zzz"], all_routes)["zzz"] == both["zzz"]
+    # Positions wrap around the palette
+    assert app._route_colors(["r11"], all_routes)["r11"] == app.PALETTE[1]
+
+
+def test_group_spans_on_strings_and_categoricals():
+    ids = ["a", "a", "b", "c", "c", "c"]
+    assert app._group_spans(pd.Series(ids)).tolist() == [0, 2, 3, 6]
+    assert app._group_spans(pd.Series(ids, dtype="category")).tolist() == [0, 2, 3, 6]
+    assert app._group_spans(pd.Series([], dtype=object)).tolist() == [0]
+
+
+def test_sort_by_trip_skips_frames_already_in_order():
+    trip = pd.Categorical.from_codes([0, 0, 1, 1], ["t9", "t1"])
+    df = pd.DataFrame({"trip_id": trip, "timestamp": [5, 7, 1, 2]})
+    # Category order, not string order, is what the sort would produce
+    assert app._sort_by_trip(df) is df
+    df.loc[3, "timestamp"] = 0
+    assert app._sort_by_trip(df)["timestamp"].tolist() == [5, 7, 0, 1]
+
+
+def test_thin_and_drop_duplicates_uses_trip_relative_offsets():
+    # t2 starts at 102 s, so its grid is 102, 112, ... rather than multiples of 10
+    ts = [100, 105, 110, 115, 120, 102, 107, 112, 117]
+    df = pd.DataFrame({
+        "trip_id": ["t1"] * 5 + ["t2"] * 4,
+        "timestamp": ts,
+        "lat": 33.8 + np.arange(9) * 1e-3,  # ~110 m apart: nothing is a duplicate
+        "lon": [132.7] * 9,
+        "route_id": ["r"] * 9,
+    })
+    out = app.thin_and_drop_duplicates(df, step_sec=10)
+    assert out["timestamp"].tolist() == [100, 110, 120, 102, 112]
+    assert list(out.columns) == ["trip_id", "lat", "lon", "timestamp", "route_id"]
+
+
+def test_route_spans_handles_missing_codes_and_unknown_ids():
+    # Cached rows are grouped by route code; the missing route (-1) sorts first
+    codes = np.array([-1, 0, 0, 1, 2])
+    categories = np.array(["a", "b", "c"], dtype=object)
+    bounds = np.searchsorted(codes, np.arange(len(categories) + 1))
+    rows = lambda ids: [i for sl in app._route_spans(bounds, categories, ids) for i in range(5)[sl]]
+    # A missing route (code -1) must never be selected
+    assert rows(["c", "zzz"]) == [4]
+    # Slices come back in code order whatever the order of the request
+    assert rows(["b", "a"]) == [1, 2, 3]
+    assert rows([]) == []
+
+
+def test_read_day_cache_rebuilds_a_corrupt_file(tmp_path, monkeypatch):
+    frame = pd.DataFrame({"trip_id": ["t"], "timestamp": [0], "lat": [33.8], "lon": [132.7]})
+    calls = []
+    monkeypatch.setattr(app, "build_day_cache", lambda date, gtfs_dir: calls.append(date) or frame)
+
+    path = app._day_cache_path("2025-07-15", str(tmp_path))
+    path.write_bytes(b"PAR1 truncated")
+    expected = app._compact_day_cache(frame)
+    assert expected["timestamp"].dtype == np.int32
+    assert isinstance(expected["trip_id"].dtype, pd.CategoricalDtype)
+    pd.testing.assert_frame_equal(app._read_day_cache("2025-07-15", str(tmp_path)), expected)
+    assert calls == ["2025-07-15"]
+    # The rebuilt file is complete and is read back without rebuilding again
+    pd.testing.assert_frame_equal(app._read_day_cache("2025-07-15", str(tmp_path)), expected)
+    assert calls == ["2025-07-15"]
+    assert [p.name for p in tmp_path.iterdir()] == [path.name]
@@ -0,0 +1,79 @@
+"""
+Unit tests for the compiled thinning/de-duplication kernels.
+
+The fused kernel must keep exactly the rows that thinning followed by
+near-duplicate removal would keep.  The inputs are tiny synthetic trips
+so the tests stay fast.
+"""
+
+import math
+
+import numpy as np
+
+from modules.fastpath import EARTH_RADIUS_M, _far_enough, thin_and_dedup
+
+
+def _arrays(lat_deg, lon_deg):
+    lat = np.deg2rad(np.asarray(lat_deg, dtype=np.float64))
+    lon = np.deg2rad(np.asarray(lon_deg, dtype=np.float64))
+    return lat, lon, np.cos(lat)
+
+
+def keep_indices(lat, lon, coslat, bounds, eps_m):
+    # Reference: de-duplication alone, keeping a point when it is at least
+    # eps_m from the last kept point of its trip
+    out = []
+    for s, e in zip(bounds[:-1], bounds[1:]):
+        p = s
+        out.append(s)
+        for i in range(s + 1, e):
+            if _far_enough(lat[p], lon[p], coslat[p], lat[i], lon[i], coslat[i], eps_m):
+                out.append(i)
+                p = i
+    return np.asarray(out, dtype=np.int64)
+
+
+def test_keep_indices_drops_points_within_eps():
+    # Trip 0 stands still for two samples, trip 1 starts at the same spot
+    lat, lon, coslat = _arrays(
+        [33.8, 33.8, 33.8, 33.801, 33.8],
+        [132.7, 132.7, 132.700001, 132.7, 132.7],
+    )
+    bounds = np.array([0, 4, 5])
+    keep = keep_indices(lat, lon, coslat, bounds, 3.0)
+    # The first point of every trip is kept regardless of distance
+    assert keep.tolist() == [0, 3, 4]
+
+
+def test_thin_and_dedup_matches_two_passes():
+    rng = np.random.default_rng(0)
+    n = 40
+    lat, lon, coslat = _arrays(
+        33.8 + np.cumsum(rng.choice([0.0, 1e-5, 1e-4], n)),
+        132.7 + np.cumsum(rng.choice([0.0, 1e-5, 1e-4], n)),
+    )
+    ts = np.r_[np.arange(0, 100, 5), np.arange(30, 130, 5)].astype(np.int64)
+    bounds = np.array([0, 20, 40])
+
+    keep = np.empty(n, dtype=bool)
+    thin_and_dedup(lat, lon, coslat, ts, bounds, 10, 3.0, keep)
+
+    # Reference: thin on the trip-relative grid, then de-duplicate what is left
+    thinned = np.flatnonzero((ts - np.repeat(ts[bounds[:-1]], np.diff(bounds))) % 10 == 0)
+    sub_bounds = np.searchsorted(thinned, bounds)
+    expected = thinned[keep_indices(lat[thinned], lon[thinned], coslat[thinned], sub_bounds, 3.0)]
+    assert np.flatnonzero(keep).tolist() == expected.tolist()
+
+
+def test_far_enough_agrees_with_haversine_near_eps():
+    # Distances straddling eps_m, where the equirectangular shortcut must defer
+    rng = np.random.default_rng(1)
+    lat = np.deg2rad(33.8)
+    for _ in range(2000):
+        d = rng.uniform(2.99, 3.01) / EARTH_RADIUS_M
+        theta = rng.uniform(0, 2 * np.pi)
+        lat2 = lat + d * np.sin(theta)
+        dlon = d * np.cos(theta) / np.cos(lat)
+        x = np.sin((lat2 - lat) / 2) ** 2 + np.cos(lat) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+        expected = 2 * EARTH_RADIUS_M * math.atan2(math.sqrt(x), math.sqrt(1 - x)) >= 3.0
+        assert _far_enough(lat, 0.0, np.cos(lat), lat2, dlon, np.cos(lat2), 3.0) == expected
@@ -9,9 +9,10 @@ tests process only a limited number of trips.
 
 import os
 
+import numpy as np
 import pandas as pd
 
-from modules.path_builder import build_day_cache
+from modules.path_builder import _interpolate_segments, build_day_cache
 
 
 def test_build_day_cache_tmpdir(tmp_path):
@@ -33,3 +34,30 @@ def test_build_day_cache_tmpdir(tmp_path):
     remainders = df["timestamp"].astype(int) % 5
     assert remainders.nunique() == 1
     assert remainders.iloc[0] == 0
+
+
+def test_interpolate_segments_appends_uneven_end():
+    # 0→10 s divides evenly into 5 s steps; 10→22 s needs the end appended
+    seg, ts, lat, lon = _interpolate_segments(
+        np.array([0, 10]), np.array([10, 22]),
+        np.array([0.0, 1.0]), np.array([0.0, 0.0]),
+        np.array([1.0, 2.2]), np.array([0.0, 1.2]),
+    )
+    assert seg.tolist() == [0, 0, 0, 1, 1, 1, 1]
+    assert ts.tolist() == [0, 5, 10, 10, 15, 20, 22]
+    np.testing.assert_allclose(lat, [0.0, 0.5, 1.0, 1.0, 1.5, 2.0, 2.2])
+    np.testing.assert_allclose(lon, [0.0, 0.0, 0.0, 0.0, 0.5, 1.0, 1.2])
+
+
+def test_build_day_cache_route_filter(tmp_path):
+    df = build_day_cache(
+        date="2025-07-10",
+        gtfs_dir="data/gtfs/2025-07-03",
+        cache_dir=str(tmp_path),
+        route_ids=["10025"],
+    )
+    assert len(df) > 0
+    assert set(df["route_id"]) == {"10025"}
+    # A route subset gets its own file next to (not instead of) the full day
+    (name,) = os.listdir(tmp_path)
+    assert name.startswith("bus_trails_2025-07-10_") and name.endswith(".parquet")
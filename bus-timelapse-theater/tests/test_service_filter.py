@@ -0,0 +1,44 @@
+"""
+Unit tests for the GTFS calendar and time helpers.
+
+The column parser must give the same seconds as the scalar
+``hhmmss_to_sec`` for every value, including the malformed ones that
+the scalar helper maps to 0.  The calendar test uses a tiny feed
+written to a temporary directory.
+"""
+
+import numpy as np
+import pandas as pd
+
+from modules.service_filter import get_valid_service_ids, hhmmss_series_to_sec, hhmmss_to_sec
+
+
+def test_hhmmss_series_to_sec_matches_scalar():
+    values = [
+        "08:00:00", "25:15:30", " 7:05:09 ", "100:00:00", "08:00:001",
+        "1:2", "1:2:3:4", "a:b:c", "", None, np.nan,
+    ]
+    out = hhmmss_series_to_sec(pd.Series(values, dtype=object))
+    assert out.dtype == np.int64
+    assert out.tolist() == [hhmmss_to_sec(str(v)) for v in values]
+    assert out.tolist()[:5] == [28800, 90930, 25509, 360000, 28801]
+
+
+def test_get_valid_service_ids_applies_calendar_dates_in_order(tmp_path):
+    (tmp_path / "calendar.txt").write_text(
+        "service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,start_date,end_date\n"
+        "weekday,1,1,1,1,1,0,0,20250101,20251231\n"
+        "expired,1,1,1,1,1,1,1,20240101,20241231\n"
+        "broken,1,1,1,1,1,1,1,bad,20251231\n"
+        "dropped,1,1,1,1,1,1,1,20250101,20251231\n"
+    )
+    (tmp_path / "calendar_dates.txt").write_text(
+        "service_id,date,exception_type\n"
+        "extra,20250710,1\n"
+        "dropped,20250710,2\n"
+        "flip,20250710,2\n"
+        "flip,20250710,1\n"
+        "other_day,20250711,1\n"
+    )
+    # 2025-07-10 is a Thursday; the last row for "flip" adds it back
+    assert get_valid_service_ids("2025-07-10", str(tmp_path)) == {"weekday", "extra", "flip"}
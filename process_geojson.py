@@ -1,6 +1,198 @@
 import json
+import mmap
 import os
 
+try:
+    import orjson
+except ImportError:  # orjson is optional: fall back to the standard json module
+    orjson = None
+
+try:
+    import ijson
+except ImportError:  # ijson is optional: without it the whole file is loaded at once
+    ijson = None
+
+# Parse errors of every parser in use (orjson's error subclasses json's)
+DECODE_ERRORS = (json.JSONDecodeError,) + ((ijson.JSONError,) if ijson is not None else ())
+
+
+def _dumps(obj):
+    """Serialize ``obj`` to compact UTF-8 JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    # Match orjson: no spaces after separators and non-ASCII kept as UTF-8
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+# Read/write buffer size: the mesh file is read once front to back, so large
+# buffers mean far fewer read() and write() system calls
+IO_BUFFER = 1 << 20
+
+# Only properties whose key starts with this prefix are kept
+PTN_PREFIX = 'PTN_'
+
+# Property key tuples seen so far, mapped to the keys among them to keep.
+# Mesh features share one schema, so the prefix test runs once per schema
+# rather than once per property of every feature.
+_kept_keys = {}
+_MAX_SCHEMAS = 1024
+
+
+def _filter_properties(feature):
+    """Keep only the properties of ``feature`` whose key starts with 'PTN_'."""
+    if isinstance(feature, dict) and isinstance(feature.get('properties'), dict):
+        properties = feature['properties']
+        keys = tuple(properties)
+        kept = _kept_keys.get(keys)
+        if kept is None:
+            kept = tuple(key for key in keys if key.startswith(PTN_PREFIX))
+            if len(_kept_keys) < _MAX_SCHEMAS:
+                _kept_keys[keys] = kept
+        # When every key is kept the dict is already the answer; don't copy it
+        if len(kept) != len(keys):
+            feature['properties'] = {key: properties[key] for key in kept}
+    return feature
+
+
+def _feed(builder, event, value, events):
+    """Pass one JSON value, starting at ``(event, value)``, from ijson ``events`` to ``builder``.
+
+    With ``builder=None`` the value is consumed and discarded without
+    creating any Python objects for it.
+    """
+    depth = 0
+    while True:
+        if builder is not None:
+            builder.event(event, value)
+        if event in ('start_map', 'start_array'):
+            depth += 1
+        elif event in ('end_map', 'end_array'):
+            depth -= 1
+        if not depth:
+            return
+        event, value = next(events)
+
+
+def _build_value(event, value, events):
+    """Assemble the JSON value starting with ``(event, value)`` from ijson events."""
+    builder = ijson.ObjectBuilder()
+    _feed(builder, event, value, events)
+    return builder.value
+
+
+def _build_feature(event, value, events):
+    """Assemble one feature, dropping non-'PTN_' properties while parsing.
+
+    Only the values of kept properties are built; the others are skipped
+    at the event level, so they never become Python objects.
+    """
+    if event != 'start_map':
+        return _build_value(event, value, events)
+    builder = ijson.ObjectBuilder()
+    builder.event(event, value)
+    for event, key in events:
+        if event == 'end_map':
+            break
+        builder.event(event, key)
+        event, value = next(events)
+        if key != 'properties' or event != 'start_map':
+            _feed(builder, event, value, events)
+            continue
+        builder.event(event, value)
+        for event, name in events:
+            if event == 'end_map':
+                break
+            event, value = next(events)
+            if name.startswith(PTN_PREFIX):
+                builder.event('map_key', name)
+                _feed(builder, event, value, events)
+            else:
+                _feed(None, event, value, events)
+        builder.event('end_map', None)
+    builder.event('end_map', None)
+    return builder.value
+
+
+def _iter_features(events):
+    """Yield the features of the array whose 'start_array' was just read, one at a time."""
+    for event, value in events:
+        if event == 'end_array':
+            return
+        yield _build_feature(event, value, events)
+
+
+def _iter_members(f):
+    """Yield the top-level ``(key, value)`` pairs of the JSON object in ``f``.
+
+    The ``features`` array is yielded as a lazy iterator, so only one
+    feature is held in memory at a time.  It must be consumed before the
+    next pair is requested.
+    """
+    events = ijson.basic_parse(f, use_float=True)
+    event, _ = next(events)
+    if event != 'start_map':
+        raise ValueError("The GeoJSON top level is not an object")
+    for event, key in events:
+        if event == 'end_map':
+            return
+        event, value = next(events)
+        if key == 'features' and event == 'start_array':
+            yield key, _iter_features(events)
+        else:
+            yield key, _build_value(event, value, events)
+
+
+def _write_members(f, members):
+    """Write ``(key, value)`` pairs as one JSON object and return the feature count.
+
+    A ``features`` value that is an iterator is written item by item as
+    it is produced, with each feature's properties filtered on the way.
+    """
+    count = 0
+    f.write(b'{')
+    for i, (key, value) in enumerate(members):
+        if i:
+            f.write(b',')
+        f.write(_dumps(key) + b':')
+        if key == 'features' and not isinstance(value, (dict, list, str)):
+            f.write(b'[')
+            for j, feature in enumerate(value):
+                if j:
+                    f.write(b',')
+                f.write(_dumps(_filter_properties(feature)))
+                count += 1
+            f.write(b']')
+        else:
+            f.write(_dumps(value))
+    f.write(b'}')
+    return count
+
+
+def _load_members(f):
+    """Load the whole JSON object in ``f`` and yield its ``(key, value)`` pairs.
+
+    The in-memory counterpart of :func:`_iter_members`: ``features`` is
+    yielded as an iterator over the loaded list, so the writer can still
+    emit it feature by feature instead of serializing everything at once.
+    """
+    print("Loading GeoJSON data into memory. This might take a moment...")
+    if orjson is not None and os.fstat(f.fileno()).st_size:
+        # orjson parses UTF-8 straight from a memory map of the file, so the
+        # file is never copied into a bytes object first (mmap rejects
+        # empty files, which take the read() path below)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+            data = orjson.loads(view)
+    else:
+        raw = f.read()
+        data = orjson.loads(raw) if orjson is not None else json.loads(raw.decode('utf-8'))
+        del raw
+    print("Data loaded. Processing features...")
+    for key, value in data.items():
+        if key == 'features' and isinstance(value, list):
+            value = iter(value)
+        yield key, value
+
+
 def process_geojson(input_path, output_path):
     """
     Reads a GeoJSON file, filters feature properties to keep only those
@@ -9,37 +201,35 @@ def process_geojson(input_path, output_path):
     print(f"Starting to process {input_path}...")
     
     try:
-        with open(input_path, 'r', encoding='utf-8') as f:
-            print("Loading GeoJSON data into memory. This might take a moment...")
-            data = json.load(f)
-        
-        print("Data loaded. Processing features...")
-        
-        original_feature_count = len(data.get('features', []))
-        
-        # Filter the properties for each feature
-        for feature in data.get('features', []):
-            if 'properties' in feature and isinstance(feature['properties'], dict):
-                original_properties = feature['properties']
-                new_properties = {
-                    key: value for key, value in original_properties.items()
-                    if key.startswith('PTN_')
-                }
-                feature['properties'] = new_properties
-        
-        print(f"Processed {original_feature_count} features.")
-        
-        # Write the modified data to the output file
-        print(f"Writing processed data to {output_path}...")
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f)
+        # Features are filtered and written one at a time.  With ijson they
+        # are also parsed one at a time, so memory stays flat however large
+        # the mesh file is.  The output goes to a temporary file first, so a
+        # failure leaves no truncated GeoJSON behind.
+        tmp_path = output_path + '.part'
+        try:
+            with open(input_path, 'rb', buffering=IO_BUFFER) as src, \
+                    open(tmp_path, 'wb', buffering=IO_BUFFER) as dst:
+                if hasattr(os, 'posix_fadvise'):
+                    # Tell the kernel to read ahead aggressively (POSIX only)
+                    os.posix_fadvise(src.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                if ijson is not None:
+                    print("Streaming features from the GeoJSON file...")
+                    members = _iter_members(src)
+                else:
+                    members = _load_members(src)
+                feature_count = _write_members(dst, members)
+            os.replace(tmp_path, output_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        print(f"Processed {feature_count} features.")
             
         print("Processing complete!")
         print(f"New file created at: {output_path}")
 
     except FileNotFoundError:
         print(f"Error: Input file not found at {input_path}")
-    except json.JSONDecodeError:
+    except DECODE_ERRORS:
         print(f"Error: Could not decode JSON from {input_path}. The file might be corrupted.")
     except Exception as e:
         print(f"An unexpected error occurred: {e}")